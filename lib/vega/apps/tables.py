@@ -1,16 +1,20 @@
 import os
+import time
+import queue
 import argparse
+import threading
 import pandas as pd
 from functools import lru_cache
-from typing import Callable, Optional, List
-import pymongo
+from typing import Callable, Optional, List, Union, Any, Dict
 
 from . import log
 from ..evm.web3 import ERC20TokenTracker, Web3Portal, ContractEvent
 from ..evm.utils import lookup
 from ..db import DataBase
 from ..db.mongo import MongoDB
-from ..utils import apply_range
+from ..db.parquet import ParquetDB
+from ..db.tiered import TieredDataBase
+from ..utils import apply_range, IntervalSet, BatchSizeController
 
 
 DATABASE_PATH = os.path.expandvars(f"$HOME/vega/data/dex.db") # not a good idea but ok for now
@@ -32,6 +36,10 @@ class Table:
     def table_name(self) -> str:
         return self._table_name
 
+    @property
+    def index(self) -> List[str]:
+        return self._index
+
     @property
     def table():
         return self.con[self.table_name]
@@ -63,12 +71,8 @@ class TokenInfo(Table):
         log.info(f"added {addr} to {self.table_name}")
     
     def delete_token(self, addr: str) -> None:
-        if isinstance(self.d, MongoDB):
-            self.d.table(self.table_name).delete_one({"addr": addr})
-        else:
-            self.d.execute(f"DELETE from {self.table_name} where addr = '{addr}'")
-            self.d.con.commit()
-            log.info(f"deleted {addr}")
+        self.d.delete(self.table_name, where={"addr": addr})
+        log.info(f"deleted {addr}")
 
     def touch(self, addr: str) -> None:
         """Touch it."""
@@ -79,17 +83,14 @@ class TokenInfo(Table):
         if touch is True:
             self.touch(addr)
         addr = self.tocsaddr(addr)
-        res = self._d.read_sql(f"SELECT * from {self._table_name} WHERE addr = '{addr}'")
+        res = self.d.query(self.table_name, where={"addr": addr}, limit=1)
         return res.iloc[0].to_dict()
     
     def token_exists(self, addr) -> bool:
         addr = self.tocsaddr(addr)
-        if isinstance(self.d, MongoDB):
-            return self.d.table(self.table_name).find_one({"addr": addr}) is not None
-        else:
-            token_count = self.d.execute(f" SELECT COUNT(*) FROM {self.table_name} WHERE addr = '{addr}' ").fetchone()[0]
-            assert token_count <= 1, f"found multiple tokens with addr {addr}"
-            return token_count > 0
+        token_count = len(self.d.query(self.table_name, columns=["addr"], where={"addr": addr}, limit=2))
+        assert token_count <= 1, f"found multiple tokens with addr {addr}"
+        return token_count > 0
         
     @property
     def d(self) -> DataBase:
@@ -105,9 +106,80 @@ class TokenInfo(Table):
         return addr
 
 
+class ArchiveWriter:
+    """ Write fetched frames on a background thread.
+
+    `put` blocks once `max_queue_size` frames are waiting, so fetching
+    can't run away from a slow database. Queued frames are coalesced
+    until `coalesce_rows` rows are pending before each `write` call,
+    after which the `done` callbacks of the written frames are called.
+    Empty frames aren't written; their `done` is called in queue order,
+    after the frames put before them are written.
+    """
+
+    _stop = object()
+
+    def __init__(self,
+                 write: Callable[[pd.DataFrame], Any],
+                 *,
+                 max_queue_size: int=8,
+                 coalesce_rows: int=50_000):
+        self._write = write
+        self._coalesce_rows = coalesce_rows
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, df: pd.DataFrame, done: Optional[Callable[[], Any]]=None):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((df, done))
+
+    def close(self):
+        """ Write whatever is pending and stop; re-raise a failed write.
+        """
+        self._queue.put(self._stop)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        pending = []
+        n = 0
+        while True:
+            item = self._queue.get()
+            stop = item is self._stop
+            if not stop:
+                pending.append(item)
+                n += len(item[0])
+            if pending and (stop or n >= self._coalesce_rows):
+                self._flush(pending)
+                pending = []
+                n = 0
+            if stop:
+                break
+
+    def _flush(self, pending: List[tuple]):
+        if self._error is not None: # keep draining so that put() doesn't block
+            return
+        try:
+            frames = [df for df, _ in pending if len(df) > 0]
+            if frames:
+                self._write(pd.concat(frames, ignore_index=True))
+            for _, done in pending:
+                if done is not None:
+                    done()
+        except Exception as e:
+            log.error(f"background write failed with error {e}")
+            self._error = e
+
+
 class EventArchive(Table):
 
     _p: ERC20TokenTracker
+    _ranges_table = "fetched_ranges" # block ranges already written, per archive
+    _versions_table = "table_versions" # changed on every write, per archive
 
     def __init__(self, *,
                  d: DataBase,
@@ -117,7 +189,14 @@ class EventArchive(Table):
                  event: Optional[ContractEvent]=None,
                  post_processor: Callable[pd.DataFrame, pd.DataFrame]=lambda x: x,
                  index: List[str]=["blockNumber", "logIndex"],
+                 indexes: List[Union[str, List[str]]]=[],
+                 types: Optional[Dict[str, str]]=None,
                  ):
+        """
+        `indexes` are the secondary indexes of the table, ensured on `d`.
+        `types` declares column types instead of inferring them from the
+        first batch, e.g. {"amount": "int256"} for uint256 amounts.
+        """
 
         self._d = d
         self._p = ERC20TokenTracker()
@@ -134,42 +213,198 @@ class EventArchive(Table):
             raise ValueError(f"set (filter_params, log_processor) or event")
         self._post_process = post_processor
         self._index = index
+        self._indexes = indexes
+        self._types = types
+        self.d.ensure_indexes(self._table_name, indexes)
+        self._fetched_ranges = None
+        self._ranges_lock = threading.Lock()
+
+    @property
+    def fetched_ranges(self) -> IntervalSet:
+        """ Inclusive block ranges whose logs are already written, loaded once from `d`.
+        """
+        with self._ranges_lock:
+            if self._fetched_ranges is None:
+                self._fetched_ranges = IntervalSet()
+                if self.d.table_exists(self._ranges_table):
+                    df = self.d.query(self._ranges_table, columns=["sblock", "eblock"], where={"table_name": self.table_name})
+                    for sblock, eblock in zip(df["sblock"], df["eblock"]):
+                        self._fetched_ranges.add(int(sblock), int(eblock))
+                log.info(f"fetched ranges of {self.table_name}: {self._fetched_ranges}")
+            return self._fetched_ranges
+
+    def mark_fetched(self, sblock: int, eblock: int):
+        """ Record [sblock, eblock] as written. The range it merges into is
+        upserted first, then the ranges it absorbed are deleted, so a
+        failure in between leaves overlapping rows, not missing ones.
+        """
+        ranges = self.fetched_ranges
+        with self._ranges_lock:
+            absorbed = [s for s, e in ranges if e >= sblock - 1 and s <= eblock + 1]
+            ranges.add(sblock, eblock)
+            merged = next((s, e) for s, e in ranges if s <= sblock <= e)
+            self.d.write(
+                pd.DataFrame([{"table_name": self.table_name, "sblock": merged[0], "eblock": merged[1]}]),
+                table_name=self._ranges_table,
+                index=["table_name", "sblock"],
+                update=True)
+            absorbed = [_ for _ in absorbed if _ != merged[0]]
+            if absorbed:
+                self.d.delete(self._ranges_table, where={"table_name": self.table_name, "sblock": absorbed})
+
+    def version(self) -> Optional[int]:
+        """ A token that changes whenever rows are written to the archive, by
+        any process; None if nothing was written since versions were kept.
+        Readers poll it to tell when their cached results are stale.
+        """
+        if not self.d.table_exists(self._versions_table):
+            return None
+        df = self.d.query(self._versions_table, columns=["version"], where={"table_name": self.table_name}, limit=1)
+        return int(df.iloc[0, 0]) if len(df) > 0 else None
+
+    def _write(self, df: pd.DataFrame):
+        """ Write rows to the archive table and bump its `version`.
+        """
+        res = self.d.write(df, table_name=self._table_name, index=self._index, types=self._types)
+        if hasattr(res, "result"): # SQLiteDB writer queue
+            res.result()
+        if self.d.table_exists(self._versions_table):
+            self.d.delete(self._versions_table, where={"table_name": self.table_name})
+        self.d.write(
+            pd.DataFrame([{"table_name": self.table_name, "version": time.time_ns()}]),
+            table_name=self._versions_table,
+            index=["table_name"])
 
     def fetch_range(self, *,
                     sblock: Optional[int]=None,
                     eblock: Optional[int]=None,
                     stime: Optional[pd.Timestamp]=None,
                     etime: Optional[pd.Timestamp]=None,
-                    batch_freq: str,
+                    batch_freq: Optional[str]=None,
+                    batch_blocks: Optional[int]=None,
                     write: bool=True,
                     return_df: bool=False,
+                    pipeline: bool=False,
+                    max_queue_size: int=8,
+                    coalesce_rows: int=50_000,
+                    skip_fetched: bool=True,
+                    concurrency: int=1,
+                    batch_controller: Optional[BatchSizeController]=None,
                     ) -> Optional[pd.DataFrame]:
-        if sblock:
-            stime = self._p.get_timestamp_from_block_number(sblock)
-        if eblock:
-            etime = self._p.get_timestamp_from_block_number(eblock)
-
-        def _fetch_range(stime: pd.Timestamp, etime: pd.Timestamp) -> pd.DataFrame:
-            df = self._p.get_logs(
-                stime=stime,
-                etime=etime,
-                filter_params=self._filter_params,
-                log_processor=self._log_processor,
-            )
-            if len(df) == 0:
-                return
-            else:
-                df = self._post_process(df)
-                if write:
-                    self.d.write(df, table_name=self._table_name, index=self._index)
+        """
+        Fetch logs between [stime, etime] in batches of `batch_freq`.
+        If `pipeline` is True, batches are written by a background
+        `ArchiveWriter` while the next batch is fetched.
+        Written block ranges are recorded in `fetched_ranges`; if
+        `skip_fetched` and `write` are True, ranges already there are not
+        fetched again. Without `write` everything is fetched, so the
+        returned frame covers the whole range.
+        With `concurrency` > 1, batches are fetched on that many threads and
+        written in block order.
+
+        If `batch_blocks` is given, [sblock, eblock] is split into batches of
+        that many blocks directly, without converting batch boundaries to and
+        from timestamps; `stime` / `etime` are only resolved to blocks if
+        `sblock` / `eblock` are missing, and a missing end means the latest block.
+
+        A `batch_controller` adapts the batch size to the log density,
+        starting from `batch_freq` / `batch_blocks`; see `BatchSizeController`.
+        """
+        assert (batch_freq is None) != (batch_blocks is None), "exactly one of batch_freq and batch_blocks is expected"
+        if batch_blocks is not None:
+            if sblock is None:
+                sblock = self._p.get_block_number_by_timestamp(pd.to_datetime(stime, utc=True))
+            if eblock is None:
+                if etime is None or pd.to_datetime(etime, utc=True) >= pd.Timestamp.utcnow():
+                    eblock = self._p.web3.eth.block_number
+                else:
+                    eblock = self._p.get_block_number_by_timestamp(pd.to_datetime(etime, utc=True))
+        else:
+            if sblock:
+                stime = self._p.get_timestamp_from_block_number(sblock)
+            if eblock:
+                etime = self._p.get_timestamp_from_block_number(eblock)
+
+        def _fetch_range(stime: pd.Timestamp, etime: pd.Timestamp) -> List[tuple]:
+            sblock = self._p.get_block_number_by_timestamp(stime)
+            eblock = self._p.get_block_number_by_timestamp(etime)
+            return _fetch_blocks(sblock, eblock)
+
+        def _fetch_block_range(sblock: int, eblock: int) -> List[tuple]:
+            # apply_range ranges are half-open, getLogs block ranges inclusive
+            return _fetch_blocks(sblock, eblock - 1)
+
+        def _fetch_blocks(sblock: int, eblock: int) -> List[tuple]:
+            ranges = self.fetched_ranges
+            with self._ranges_lock:
+                block_ranges = ranges.missing(sblock, eblock) if skip_fetched and write else [(sblock, eblock)]
+            if not block_ranges:
+                log.info(f"skipping blocks {[sblock, eblock]}, already fetched")
+            fetched = []
+            for s, e in block_ranges:
+                df = self._p.get_logs(
+                    sblock=s,
+                    eblock=e,
+                    filter_params=self._filter_params,
+                    log_processor=self._log_processor,
+                )
+                fetched.append((s, e, self._post_process(df) if len(df) > 0 else None))
+            return fetched
+
+        def _count_logs(fetched: List[tuple]) -> int:
+            return sum([len(df) for _, _, df in fetched if df is not None])
+
+        def _write_range(fetched: List[tuple]) -> Optional[pd.DataFrame]:
+            frames = []
+            for s, e, df in fetched:
+                done = lambda s=s, e=e: self.mark_fetched(s, e)
+                if df is None:
+                    if write and writer is not None: # marked after the frames queued before it are written
+                        writer.put(pd.DataFrame(), done)
+                    elif write:
+                        done()
+                    continue
+                if write and writer is not None:
+                    writer.put(df, done)
+                elif write:
+                    self._write(df)
+                    done()
                 if return_df:
-                    return df
-        etime = min(pd.to_datetime(etime, utc=True), pd.Timestamp.utcnow())
-        res = apply_range(
-                func=_fetch_range,
-                start=stime,
-                end=etime,
-                max_batch_size=pd.Timedelta(batch_freq))
+                    frames.append(df)
+            if return_df and frames:
+                return pd.concat(frames)
+        writer = None
+        if write and pipeline:
+            writer = ArchiveWriter(
+                self._write,
+                max_queue_size=max_queue_size,
+                coalesce_rows=coalesce_rows)
+        try:
+            if batch_blocks is not None:
+                res = apply_range(
+                        func=_fetch_block_range,
+                        start=int(sblock),
+                        end=int(eblock) + 1,
+                        max_batch_size=int(batch_blocks),
+                        concurrency=concurrency,
+                        on_result=_write_range,
+                        controller=batch_controller,
+                        count=_count_logs)
+            else:
+                res = apply_range(
+                        func=_fetch_range,
+                        start=stime,
+                        end=min(pd.to_datetime(etime, utc=True), pd.Timestamp.utcnow()),
+                        max_batch_size=pd.Timedelta(batch_freq),
+                        concurrency=concurrency,
+                        on_result=_write_range,
+                        controller=batch_controller,
+                        count=_count_logs)
+        finally:
+            if writer is not None:
+                writer.close()
+            if batch_controller is not None:
+                log.info(f"batch sizes: {batch_controller.summary()}")
         if return_df:
             df = pd.concat(res)
             return df
@@ -179,27 +414,47 @@ class EventArchive(Table):
     
     def fetch_new(self,
                   *,
-                  batch_freq: str,
+                  batch_freq: Optional[str]=None,
+                  batch_blocks: Optional[int]=None,
                   block_number_col: str="blockNumber",
-                  ):
-        """Bootstrap from max block in the table.
+                  **kw):
+        """Bootstrap from the end of the fetched range holding the last fetched block, or else the max block in the table.
+        Older gaps are not revisited; fill them with `fetch_range(skip_fetched=True)`.
+        Other keyword arguments are passed to `fetch_range`.
         """
-        #stime = pd.to_datetime(self.d.read_sql(f" SELECT MAX({time_col}) from {token_info.table_name}").iloc[0, 0])
-        sblock = int(self.d.con[self.table_name].find().sort(block_number_col, -1).limit(1)[0][block_number_col]) - 1
+        if len(self.fetched_ranges) > 0:
+            sblock = self.fetched_ranges.max_end + 1
+        else:
+            last = self.d.query(self.table_name, columns=[block_number_col], order_by=f"-{block_number_col}", limit=1)
+            sblock = int(last.iloc[0, 0]) - 1
+        if batch_blocks is not None:
+            log.info(f"bootstrapping from block {sblock}")
+            self.fetch_range(sblock=sblock, batch_blocks=batch_blocks, **kw)
+            return
         stime = self._p.get_timestamp_from_block_number(sblock)
         log.info(f"bootstrapping from block {sblock} {stime}")
         etime = pd.Timestamp.utcnow()
-        self.fetch_range(stime=stime, etime=etime, batch_freq=batch_freq)
+        self.fetch_range(stime=stime, etime=etime, batch_freq=batch_freq, **kw)
 
 
-def event_archive_factory(name: str) -> EventArchive:
+def event_archive_factory(name: str,
+                          binary_hex: bool=False,
+                          cold_dir: Optional[str]=None,
+                          hot_blocks: int=500_000,
+                          ) -> EventArchive:
     """Create commonly used archives.
+    If `cold_dir` is given, blocks older than the last `hot_blocks` can be
+    migrated to a Parquet cold tier there, see `TieredDataBase`.
     """
 
     p = ERC20TokenTracker()
     p.init()
     d = MongoDB()
-    d.init()
+    d.init(binary_hex=binary_hex)
+    if cold_dir is not None:
+        cold = ParquetDB()
+        cold.init(cold_dir, binary_hex=binary_hex)
+        d = TieredDataBase(d, cold, hot_blocks=hot_blocks)
     weth = p.get_contract(addr=lookup("addr")["WETH"])
 
     def try_process_log(e):
@@ -217,37 +472,37 @@ def event_archive_factory(name: str) -> EventArchive:
         output_cols = [_ for _ in output_cols if _ in df.columns]
         return df[output_cols].copy()
 
+    common_indexes = ["transactionHash"] # block numbers are served by the (blockNumber, logIndex) index
+    amount_types = {"amount": "int256"} # uint256, whatever the first batch holds
     if name == "weth_deposit":
-        d.con[name].create_index("dst")
         ea = EventArchive(
             d=d,
             table_name=name,
             event=weth.events["Deposit"](),
             post_processor=post_process,
+            indexes=["dst"] + common_indexes,
+            types=amount_types,
         )
-        ea.d.con[name].create_index("addr")
     elif name == "weth_withdrawal":
-        d.con[name].create_index("src")
         ea = EventArchive(
             d=d,
             table_name=name,
             event=weth.events["Withdrawal"](),
             post_processor=post_process,
+            indexes=["src"] + common_indexes,
+            types=amount_types,
         )
     elif name == "weth_transfer":
-        d.con[name].create_index("src")
-        d.con[name].create_index("dst")
         ea = EventArchive(
             d=d,
             table_name=name,
             event=weth.events["Transfer"](),
             post_processor=post_process,
+            indexes=["src", "dst"] + common_indexes,
+            types=amount_types,
         )
     elif name == "token_transfer":
         e = weth.events["Transfer"]()
-        d.con[name].create_index("src")
-        d.con[name].create_index("dst")
-        d.con[name].create_index("address")
         erc20_transfer_topic = e._get_event_filter_params(e.abi)["topics"][0]
         ea = EventArchive(
             d=d,
@@ -258,6 +513,8 @@ def event_archive_factory(name: str) -> EventArchive:
                 post_process(
                     df,
                     output_cols=["address", "src", "dst", "amount", "transactionHash", "blockNumber"]),
+            indexes=["src", "dst", "address"] + common_indexes,
+            types=amount_types,
         )
     elif name == "uniswap_v2_swap":
 
@@ -273,19 +530,18 @@ def event_archive_factory(name: str) -> EventArchive:
             df["amount1"] = df["args_amount1In"] - df["args_amount1Out"]
             return df.drop(["args_amount0In", "args_amount1In", "args_amount0Out", "args_amount1Out", "blockHash"], axis=1)
 
-        d.table(name).create_index("address")
         ea = EventArchive(
             d=d,
             table_name=name,
             filter_params={"topics": [swap_topic]},
             log_processor=try_process_log(e),
             post_processor=post_processor,
+            indexes=["address"] + common_indexes,
+            types={"amount0": "int256", "amount1": "int256"},
         )
     else:
         raise ValueError(name)
 
-    d.con[name].create_index("transactionHash")
-    d.con[name].create_index([("blockNumber", pymongo.ASCENDING)])# speed up searching
     return ea
 
 
@@ -298,5 +554,13 @@ def event_archive_parser() -> argparse.ArgumentParser:
     parser.add_argument("--stime", type=str, help="parsable by pd.to_datetime")
     parser.add_argument("--etime", type=str, default="20991231", help="parsable by pd.to_datetime")
     parser.add_argument("--fetch-new", action="store_true")
+    parser.add_argument("--pipeline", action="store_true", help="write in the background while fetching")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of batches fetched in parallel")
+    parser.add_argument("--batch-blocks", type=int, default=None, help="batch by this many blocks instead of --batch-freq")
+    parser.add_argument("--adaptive", action="store_true", help="adapt the batch size to the log density")
+    parser.add_argument("--target-logs", type=int, default=None, help="with --adaptive, aim for this many logs per request")
+    parser.add_argument("--binary-hex", action="store_true", help="store addresses and hashes as raw bytes")
+    parser.add_argument("--cold-dir", type=str, help="directory of the Parquet cold tier; migrate old blocks there after fetching")
+    parser.add_argument("--hot-blocks", type=int, default=500_000, help="number of recent blocks kept in the hot tier")
 
     return parser
\ No newline at end of file
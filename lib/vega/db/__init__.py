@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
-from typing import Union, List
+from typing import Union, List, Optional, Dict, Tuple, Any
 
 from .. import log
 
@@ -32,4 +33,88 @@ class DataBase(ABC):
                      table_name: str,
                      columns: List[str],
                      index=Union[str, List[str]]):
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def query(self,
+              table_name: str,
+              *,
+              columns: Optional[List[str]]=None,
+              where: Optional[Dict[str, Any]]=None,
+              block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+              order_by: Optional[Union[str, List[str]]]=None,
+              limit: Optional[int]=None,
+              ) -> pd.DataFrame:
+        """ Structured read, translated by each backend to its native form.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to return, all if None.
+        where : dict, optional
+            {column: value} for equality, {column: [values]} for membership.
+        block_range : (start, end), optional
+            Keep rows with start <= blockNumber < end; either end can be None.
+        order_by : str or list of str, optional
+            Columns to sort by; prefix with "-" for descending.
+        limit : int, optional
+        """
+        pass
+
+    @abstractmethod
+    def delete(self,
+               table_name: str,
+               *,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> int:
+        """ Delete rows matching `where` and `block_range` (see `query`);
+        return the number deleted. At least one of them is required.
+        """
+        pass
+
+    def ensure_indexes(self, table_name: str, indexes: List[Union[str, List[str]]]):
+        """ Create secondary `indexes` on `table_name`, in backends that have them;
+        a no-op otherwise.
+        """
+        pass
+
+
+def is_multi_value(v: Any) -> bool:
+    """ Whether a `where` value means membership rather than equality:
+    a list, tuple, set, Series, Index or array of at least one dimension.
+    Scalars, numpy scalars (e.g. np.int64) and str/bytes are single values.
+    """
+    if isinstance(v, (str, bytes, np.generic)):
+        return False
+    if isinstance(v, (list, tuple, set, frozenset)):
+        return True
+    return hasattr(v, "__array__") and np.ndim(v) > 0
+
+
+def parse_order_by(order_by: Optional[Union[str, List[str]]]) -> List[Tuple[str, bool]]:
+    """ "-col" -> ("col", False); returns [(column, ascending)].
+    """
+    if order_by is None:
+        return []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    return [(_[1:], False) if _.startswith("-") else (_, True) for _ in order_by]
+
+
+def sort_and_limit(df: pd.DataFrame,
+                   *,
+                   columns: Optional[List[str]]=None,
+                   order_by: Optional[Union[str, List[str]]]=None,
+                   limit: Optional[int]=None,
+                   ) -> pd.DataFrame:
+    """ Apply `order_by` and `limit` in pandas, for backends without a query engine.
+    """
+    order = parse_order_by(order_by)
+    if order:
+        df = df.sort_values([_[0] for _ in order], ascending=[_[1] for _ in order], kind="stable")
+    if limit is not None:
+        df = df.iloc[:limit]
+    if columns is not None:
+        df = df[columns]
+    return df.reset_index(drop=True)
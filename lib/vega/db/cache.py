@@ -0,0 +1,197 @@
+import time
+import threading
+import pandas as pd
+from collections import OrderedDict
+from typing import Union, List, Optional, Dict, Tuple, Any, Callable
+
+from . import DataBase, log, is_multi_value
+
+
+__all__ = [
+    "CachedDataBase",
+]
+
+
+class CachedDataBase(DataBase):
+    """ A query-result cache in front of another DataBase.
+
+    Results of `query` are keyed by the normalized query and tagged with
+    the table's version counter, which every `write` / `delete` through
+    this wrapper bumps, so a cached result is never served after its table
+    changed. Entries are evicted least-recently-used once their total size
+    exceeds `max_bytes`.
+
+    Writes made directly to the wrapped database, e.g. by an ingestion
+    process, are only seen through `probe`: a cheap callable of the table
+    name (say, its max block number) called at most every `probe_interval`
+    seconds per table; a changed value invalidates the table.
+    """
+
+    def __init__(self,
+                 d: DataBase,
+                 *,
+                 max_bytes: int=256 * 2**20,
+                 probe: Optional[Callable[[str], Any]]=None,
+                 probe_interval: float=1.):
+        self._d = d
+        self._max_bytes = max_bytes
+        self._probe = probe
+        self._probe_interval = probe_interval
+        self._probed = {} # table_name -> (time, value)
+        self._entries = OrderedDict() # key -> (version, df, nbytes)
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def d(self) -> DataBase:
+        return self._d
+
+    def __getattr__(self, name: str) -> Any:
+        # anything backend-specific, e.g. `con`, goes to the wrapped database
+        return getattr(self._d, name)
+
+    def init(self, *a, **kw):
+        self._d.init(*a, **kw)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": self._stats["hits"] / max(self._stats["hits"] + self._stats["misses"], 1),
+            }
+
+    def version(self, table_name: str) -> int:
+        return self._versions.get(table_name, 0)
+
+    def refresh(self, table_name: str) -> int:
+        """ Check `probe` for outside writes and return the current version of
+        `table_name`, e.g. to key results derived from its queries.
+        """
+        self._check_probe(table_name)
+        return self.version(table_name)
+
+    def invalidate(self, table_name: str):
+        """ Bump the version of `table_name` and drop its cached results.
+        """
+        with self._lock:
+            self._versions[table_name] = self.version(table_name) + 1
+            for key in [_ for _ in self._entries if _[0] == table_name]:
+                self._bytes -= self._entries.pop(key)[2]
+                self._stats["invalidations"] += 1
+
+    def query(self,
+              table_name: str,
+              *,
+              columns: Optional[List[str]]=None,
+              where: Optional[Dict[str, Any]]=None,
+              block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+              order_by: Optional[Union[str, List[str]]]=None,
+              limit: Optional[int]=None,
+              ) -> pd.DataFrame:
+        """ See `DataBase.query`. Returns a copy, so callers may modify it.
+        """
+        key = _normalize_query(table_name, columns=columns, where=where, block_range=block_range, order_by=order_by, limit=limit)
+        self._check_probe(table_name)
+        with self._lock:
+            version = self.version(table_name)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1].copy()
+            self._stats["misses"] += 1
+        df = self._d.query(table_name, columns=columns, where=where, block_range=block_range, order_by=order_by, limit=limit)
+        self._put(key, version, df)
+        return df.copy()
+
+    def _check_probe(self, table_name: str):
+        if self._probe is None:
+            return
+        now = time.monotonic()
+        last = self._probed.get(table_name)
+        if last is not None and now - last[0] < self._probe_interval:
+            return
+        value = self._probe(table_name)
+        self._probed[table_name] = (now, value)
+        if last is not None and value != last[1]:
+            log.info(f"{table_name} changed outside the cache: {last[1]} -> {value}")
+            self.invalidate(table_name)
+
+    def _put(self, key: tuple, version: int, df: pd.DataFrame):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self._max_bytes:
+            return
+        with self._lock:
+            if version != self.version(key[0]): # written while querying
+                return
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (version, df, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self._max_bytes:
+                _, (_, _, n) = self._entries.popitem(last=False)
+                self._bytes -= n
+                self._stats["evictions"] += 1
+
+    def write(self, df: pd.DataFrame, *, table_name: str, **kw):
+        try:
+            return self._d.write(df, table_name=table_name, **kw)
+        finally:
+            self.invalidate(table_name)
+
+    def delete(self,
+               table_name: str,
+               *,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> int:
+        try:
+            return self._d.delete(table_name, where=where, block_range=block_range)
+        finally:
+            self.invalidate(table_name)
+
+    def create_table(self, *, table_name: str, **kw):
+        self.invalidate(table_name)
+        return self._d.create_table(table_name=table_name, **kw)
+
+    def delete_table(self, table_name: str) -> bool:
+        try:
+            return self._d.delete_table(table_name)
+        finally:
+            self.invalidate(table_name)
+
+    def ensure_indexes(self, table_name: str, indexes: List[Union[str, List[str]]]):
+        return self._d.ensure_indexes(table_name, indexes)
+
+    def read_table(self, table_name: str, *a, **kw) -> pd.DataFrame:
+        return self._d.read_table(table_name, *a, **kw)
+
+    def table_exists(self, table_name: str) -> bool:
+        return self._d.table_exists(table_name)
+
+
+def _normalize_query(table_name: str, *,
+                     columns: Optional[List[str]],
+                     where: Optional[Dict[str, Any]],
+                     block_range: Optional[Tuple[Optional[int], Optional[int]]],
+                     order_by: Optional[Union[str, List[str]]],
+                     limit: Optional[int],
+                     ) -> tuple:
+    """ A hashable key; membership values are order-insensitive.
+    """
+    where_key = tuple(sorted(
+        (k, tuple(sorted(map(repr, v))) if is_multi_value(v) else repr(v))
+        for k, v in (where or {}).items()
+    ))
+    return (
+        table_name,
+        tuple(columns) if columns is not None else None,
+        where_key,
+        tuple(block_range) if block_range is not None else None,
+        (order_by,) if isinstance(order_by, str) else tuple(order_by or ()),
+        limit,
+    )
@@ -0,0 +1,184 @@
+"""
+Column types shared by the storage backends.
+
+Every column written by a backend is tagged with one of the logical
+types in `COLUMN_TYPES`, inferred from the DataFrame dtypes by
+`infer_schema` or declared by the caller. Each backend maps the logical
+types to its native ones.
+
+A table's types are fixed by its first write, which may not have seen
+every kind of value yet: a column without any value is "null" until a
+later write resolves it, and an "int" column that receives a value wider
+than int64 is widened to "int256", see `widen_schema`.
+
+Wide integers (uint256 / int256 token amounts) don't fit any native
+numeric type. They are stored as 32-byte big-endian offset binary, i.e.
+`x + 2**255`, so that byte-wise comparison (SQLite BLOB memcmp, Mongo
+BinData) orders them numerically, negative values included.
+
+Optionally (`binary_hex=True` on inference), hex strings of addresses and
+32-byte hashes are tagged "address" / "hash" and stored as raw 20 / 32
+bytes instead of 42 / 66 characters, which shrinks the tables and their
+indexes 2-3x. Addresses read back checksummed, hashes lowercase.
+"""
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Any, Iterable, Optional
+from pandas.api.types import (
+    infer_dtype,
+    is_bool_dtype,
+    is_integer_dtype,
+    is_float_dtype,
+    is_datetime64_any_dtype,
+)
+
+
+__all__ = [
+    "COLUMN_TYPES",
+    "INT64_MIN",
+    "INT64_MAX",
+    "encode_int256",
+    "decode_int256",
+    "encode_hex",
+    "decode_hex",
+    "hex_type",
+    "infer_type",
+    "infer_schema",
+    "widen_type",
+    "widen_schema",
+    "datetime_to_ns",
+    "ns_to_datetime",
+]
+
+
+COLUMN_TYPES = ["bool", "int", "float", "int256", "datetime", "address", "hash", "str", "null"]
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+INT256_BYTES = 32
+INT256_OFFSET = 1 << 255
+HEX_BYTES = {"address": 20, "hash": 32}
+
+
+def encode_int256(x: int) -> bytes:
+    return (int(x) + INT256_OFFSET).to_bytes(INT256_BYTES, "big")
+
+
+def decode_int256(b: bytes) -> int:
+    return int.from_bytes(b, "big") - INT256_OFFSET
+
+
+def encode_hex(x: str) -> bytes:
+    return bytes.fromhex(x[2:] if x.startswith("0x") else x)
+
+
+def decode_hex(values: Iterable[Optional[bytes]], column_type: str) -> List[Optional[str]]:
+    """ Decode "address" / "hash" bytes back to 0x-prefixed hex strings.
+    Addresses are checksummed, once per distinct value.
+    """
+    values = [None if _ is None else bytes(_) for _ in values]
+    if column_type == "address":
+        from ..evm.utils import csaddr
+        decoded = {_: csaddr("0x" + _.hex()) for _ in set(values) if _ is not None}
+    else:
+        decoded = {_: "0x" + _.hex() for _ in set(values) if _ is not None}
+    return [None if _ is None else decoded[_] for _ in values]
+
+
+def hex_type(s: pd.Series) -> Optional[str]:
+    """ "address" or "hash" if every value of `s` is a hex string of that size.
+    """
+    s = s.dropna()
+    if len(s) == 0 or infer_dtype(s) != "string":
+        return None
+    for column_type, n in HEX_BYTES.items():
+        if s.str.fullmatch(f"0x[0-9a-fA-F]{{{2 * n}}}").all():
+            return column_type
+    return None
+
+
+def _fits_int64(s: pd.Series) -> bool:
+    s = s.dropna()
+    return len(s) == 0 or (int(s.min()) >= INT64_MIN and int(s.max()) <= INT64_MAX)
+
+
+def infer_type(s: pd.Series, binary_hex: bool=False) -> str:
+    """ Infer the logical column type of `s`, one of `COLUMN_TYPES`.
+    "address" and "hash" are only inferred if `binary_hex` is True;
+    "null" means `s` has no value to infer from.
+    """
+    if not s.notna().any():
+        return "null"
+    elif is_bool_dtype(s):
+        return "bool"
+    elif is_integer_dtype(s):
+        return "int" if _fits_int64(s) else "int256"
+    elif is_float_dtype(s):
+        return "float"
+    elif is_datetime64_any_dtype(s):
+        return "datetime"
+    inferred = infer_dtype(s, skipna=True)
+    if inferred == "boolean":
+        return "bool"
+    elif inferred == "integer":
+        return "int" if _fits_int64(s) else "int256"
+    elif inferred in ("floating", "mixed-integer-float"):
+        return "float"
+    elif inferred in ("datetime", "datetime64"):
+        return "datetime"
+    elif binary_hex:
+        return hex_type(s) or "str"
+    else:
+        return "str"
+
+
+def infer_schema(df: pd.DataFrame,
+                 binary_hex: bool=False,
+                 types: Optional[Dict[str, str]]=None) -> Dict[str, str]:
+    """ Logical types of the columns of `df`. `types` declares the types of
+    some columns instead, e.g. {"amount": "int256"} for uint256 amounts
+    whose first values happen to fit in int64.
+    """
+    types = types or {}
+    return {v: types.get(v) or infer_type(df[v], binary_hex=binary_hex) for v in df.columns}
+
+
+def widen_type(current: str, inferred: str) -> str:
+    """ The type a column of type `current` needs to also hold values of
+    type `inferred`: "null" takes any type, "int" widens to "int256".
+    Other mismatches keep `current`.
+    """
+    if current == "null":
+        return inferred
+    elif current == "int" and inferred == "int256":
+        return "int256"
+    return current
+
+
+def widen_schema(schema: Dict[str, str],
+                 df: pd.DataFrame,
+                 binary_hex: bool=False,
+                 types: Optional[Dict[str, str]]=None) -> Dict[str, str]:
+    """ {column: widened type} for the columns of `df` whose type in
+    `schema` can't hold their values, see `widen_type`.
+    """
+    types = types or {}
+    res = {}
+    for v in df.columns:
+        current = schema.get(v)
+        if current not in ("null", "int"): # nothing else widens
+            continue
+        widened = widen_type(current, types.get(v) or infer_type(df[v], binary_hex=binary_hex))
+        if widened != current:
+            res[v] = widened
+    return res
+
+
+def datetime_to_ns(s: pd.Series) -> pd.Series:
+    """ Convert to integer nanoseconds since epoch (UTC).
+    """
+    s = pd.to_datetime(s, utc=True)
+    return (s - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(1, "ns")
+
+
+def ns_to_datetime(s: pd.Series) -> pd.Series:
+    return pd.to_datetime(s, unit="ns", utc=True)
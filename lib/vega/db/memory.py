@@ -0,0 +1,344 @@
+import os
+import json
+import threading
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from typing import Union, List, Optional, Dict, Tuple, Any
+
+from . import DataBase, log, is_multi_value, sort_and_limit, parse_order_by
+from .codec import infer_schema, widen_schema, encode_int256, decode_int256
+
+
+__all__ = [
+    "MemoryDB",
+]
+
+
+class _MemoryTable:
+    """ One table as NumPy column arrays.
+
+    - "str" columns (addresses, hashes) are dictionary-encoded: an int32
+      code array plus the array of distinct values.
+    - "int256" columns are (n, 32) uint8 arrays of offset binary, see codec.py.
+    - "null" columns, without a value so far, are object arrays.
+    - Other columns are plain arrays of their native dtype.
+
+    Rows are kept sorted by `block_number_col` if the table has it, so
+    block ranges are found by binary search.
+    """
+
+    def __init__(self, *,
+                 index: List[str],
+                 types: Dict[str, str],
+                 block_number_col: str):
+        self.index = index
+        self.types = types
+        self.block_number_col = block_number_col if block_number_col in types else None
+        self.columns = {}
+        self.categories = {k: np.array([], dtype=str) for k, v in types.items() if v == "str"}
+        self.codes = {k: {} for k in self.categories} # value -> code
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def encode(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        res = {}
+        for v in self.types:
+            s = df[v]
+            column_type = self.types[v]
+            if column_type == "str":
+                values = s.astype(str).to_numpy(dtype=object)
+                codes = self.codes[v]
+                new_values = [_ for _ in pd.unique(values) if _ not in codes]
+                for value in new_values:
+                    codes[value] = len(codes)
+                if new_values:
+                    self.categories[v] = np.concatenate([self.categories[v], np.array(new_values, dtype=str)])
+                res[v] = np.fromiter((codes[_] for _ in values), dtype=np.int32, count=len(values))
+            elif column_type == "int256":
+                buf = b"".join([encode_int256(_) for _ in s])
+                res[v] = np.frombuffer(buf, dtype=np.uint8).reshape(len(s), 32)
+            elif column_type == "int":
+                res[v] = s.to_numpy(dtype=np.int64)
+            elif column_type == "float":
+                res[v] = s.to_numpy(dtype=np.float64)
+            elif column_type == "bool":
+                res[v] = s.to_numpy(dtype=bool)
+            elif column_type == "datetime":
+                res[v] = pd.to_datetime(s, utc=True).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+            elif column_type == "null":
+                res[v] = s.to_numpy(dtype=object)
+            else:
+                raise ValueError(f"unsupported column type {column_type}")
+        return res
+
+    def append(self, df: pd.DataFrame):
+        """ Merge `df` into the table; on duplicated index the last row wins.
+        """
+        new = self.encode(df)
+        if self.columns:
+            columns = {k: np.concatenate([self.columns[k], new[k]]) for k in self.types}
+        else:
+            columns = new
+        n = len(columns[self.index[0]])
+        keys = pd.DataFrame({k: columns[k] if columns[k].ndim == 1 else list(map(bytes, columns[k])) for k in self.index})
+        keep = ~keys.duplicated(keep="last").to_numpy()
+        if self.block_number_col is not None:
+            order = np.argsort(columns[self.block_number_col][keep], kind="stable")
+            rows = np.arange(n)[keep][order]
+        else:
+            rows = np.arange(n)[keep]
+        self.columns = {k: v[rows] for k, v in columns.items()}
+
+    def widen(self, types: Dict[str, str]) -> "_MemoryTable":
+        """ A copy of the table with column types changed to `types`, see `widen_type`.
+        """
+        t = _MemoryTable(index=self.index, types={**self.types, **types}, block_number_col=self.block_number_col)
+        if len(self) > 0:
+            t.append(self.select())
+        return t
+
+    def mask(self, where: Optional[Dict[str, Any]], lo: int, hi: int) -> np.ndarray:
+        """ Rows in [lo, hi) matching `where`.
+        """
+        mask = np.ones(max(hi - lo, 0), dtype=bool)
+        for k, v in (where or {}).items():
+            values = list(v) if is_multi_value(v) else [v]
+            if self.types[k] == "str":
+                codes = [self.codes[k][_] for _ in values if _ in self.codes[k]]
+                mask &= np.isin(self.columns[k][lo:hi], codes)
+            elif self.types[k] == "int256":
+                encoded = {encode_int256(_) for _ in values}
+                mask &= np.array([bytes(_) in encoded for _ in self.columns[k][lo:hi]], dtype=bool)
+            else:
+                mask &= np.isin(self.columns[k][lo:hi], values)
+        return mask
+
+    def rows(self, block_range: Optional[Tuple[Optional[int], Optional[int]]]) -> Tuple[int, int]:
+        """ [lo, hi) of the rows in `block_range`; rows are sorted by block number.
+        """
+        lo, hi = 0, len(self)
+        if block_range is not None:
+            assert self.block_number_col is not None, f"table has no block number column"
+            blocks = self.columns[self.block_number_col]
+            start, end = block_range
+            if start is not None:
+                lo = int(np.searchsorted(blocks, start, side="left"))
+            if end is not None:
+                hi = int(np.searchsorted(blocks, end, side="left"))
+        return lo, hi
+
+    def delete(self,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None) -> int:
+        if not self.columns:
+            return 0
+        lo, hi = self.rows(block_range)
+        keep = np.ones(len(self), dtype=bool)
+        keep[lo:hi] = ~self.mask(where, lo, hi)
+        self.columns = {k: v[keep] for k, v in self.columns.items()}
+        return int((~keep).sum())
+
+    def select(self, *,
+               columns: Optional[List[str]]=None,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> pd.DataFrame:
+        lo, hi = self.rows(block_range)
+        mask = self.mask(where, lo, hi)
+        res = {}
+        for k in (columns or list(self.types)):
+            v = self.columns[k][lo:hi][mask] if self.columns else np.array([])
+            if self.types[k] == "str":
+                res[k] = self.categories[k][v] if len(v) else np.array([], dtype=object)
+            elif self.types[k] == "int256":
+                res[k] = pd.Series([decode_int256(bytes(_)) for _ in v], dtype=object)
+            elif self.types[k] == "datetime":
+                res[k] = pd.to_datetime(v).tz_localize("UTC")
+            else:
+                res[k] = v
+        return pd.DataFrame(res)
+
+
+class MemoryDB(DataBase):
+    """ An in-process DataBase holding tables as NumPy column arrays.
+
+    Tables can be snapshotted to a directory of .npy files and restored
+    memory-mapped, so a restarted process doesn't re-read them from the
+    primary database. Data lives only in this process otherwise.
+    """
+
+    _meta_file = "_meta.json"
+
+    def init(self,
+             snapshot_dir: Optional[str]=None,
+             block_number_col: str="blockNumber"):
+        """ Restore from `snapshot_dir` if it has a snapshot.
+        """
+        self._tables = {}
+        self._block_number_col = block_number_col
+        self._snapshot_dir = Path(snapshot_dir) if snapshot_dir is not None else None
+        self._lock = threading.Lock()
+        if self._snapshot_dir is not None and (self._snapshot_dir / self._meta_file).exists():
+            self.restore(self._snapshot_dir)
+
+    def table_exists(self, table_name: str) -> bool:
+        return table_name in self._tables
+
+    def create_table(self, *,
+                     table_name: str,
+                     columns: List[str],
+                     index: Union[str, List[str]],
+                     types: Optional[Dict[str, str]]=None):
+        if isinstance(index, str):
+            index = [index]
+        assert all([_ in columns for _ in index]), f"not all of {index} are found in {columns}"
+        assert not self.table_exists(table_name), f"table {table_name} already exists"
+        if types is None:
+            types = {k: "str" for k in columns}
+        self._tables[table_name] = _MemoryTable(
+            index=index,
+            types={k: types[k] for k in columns},
+            block_number_col=self._block_number_col)
+        log.info(f"created in-memory table {table_name}; index = {index}; types = {types}")
+
+    def write(self,
+              df: pd.DataFrame,
+              *,
+              table_name: str,
+              index: Union[str, List[str]],
+              types: Optional[Dict[str, str]]=None,
+              update: bool=True):
+        """ Upsert `df` by index, whatever `update` is; it's accepted so that
+        callers of `MongoDB.write(update=True)`, e.g. TokenInfo, work unchanged.
+        Column types are inferred or declared in `types` as in `SQLiteDB.write`.
+        """
+        if not self.table_exists(table_name):
+            self.create_table(table_name=table_name, columns=list(df.columns), index=index, types=infer_schema(df, types=types))
+        with self._lock:
+            widened = widen_schema(self._tables[table_name].types, df, types=types)
+            if widened:
+                self._tables[table_name] = self._tables[table_name].widen(widened)
+                log.info(f"widened columns of memory:{table_name}: {widened}")
+            self._tables[table_name].append(df)
+        log.info(f"{len(df)} rows are written to memory:{table_name}.")
+
+    def read_table(self,
+                   table_name: str,
+                   *,
+                   columns: Optional[List[str]]=None,
+                   where: Optional[Dict[str, Any]]=None,
+                   block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                   ) -> pd.DataFrame:
+        """
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to read, all if None.
+        where : dict, optional
+            {column: value} equality, or {column: [values]} membership.
+        block_range : (start, end), optional
+            Keep rows with start <= block number < end; either end can be None.
+        """
+        return self._tables[table_name].select(columns=columns, where=where, block_range=block_range)
+
+    def query(self,
+              table_name: str,
+              *,
+              columns: Optional[List[str]]=None,
+              where: Optional[Dict[str, Any]]=None,
+              block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+              order_by: Optional[Union[str, List[str]]]=None,
+              limit: Optional[int]=None,
+              ) -> pd.DataFrame:
+        """ See `DataBase.query`.
+        """
+        read_columns = None if columns is None else list(dict.fromkeys(columns + [k for k, _ in parse_order_by(order_by)]))
+        df = self.read_table(table_name, columns=read_columns, where=where, block_range=block_range)
+        return sort_and_limit(df, columns=columns, order_by=order_by, limit=limit)
+
+    def delete(self,
+               table_name: str,
+               *,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> int:
+        assert where or block_range, "refusing to delete without conditions"
+        with self._lock:
+            n = self._tables[table_name].delete(where, block_range)
+        log.info(f"deleted {n} rows from memory:{table_name} where {where}, block_range = {block_range}")
+        return n
+
+    def delete_table(self, table_name: str) -> bool:
+        """ Return True if deleted is done.
+        """
+        while True:
+            cmd = input(f"delete {table_name}? (yes/no)")
+            if cmd == "yes":
+                self._tables.pop(table_name)
+                return True
+            elif cmd == "no":
+                return False
+
+    def snapshot(self, snapshot_dir: Optional[str]=None):
+        """ Save every table as one .npy file per array, plus a meta file.
+        Files are written aside and renamed into place, so snapshotting a
+        restored database doesn't overwrite the files its arrays are mapped from.
+        """
+        snapshot_dir = Path(snapshot_dir) if snapshot_dir is not None else self._snapshot_dir
+        assert snapshot_dir is not None, "snapshot_dir is not set"
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        meta = {}
+        with self._lock:
+            for table_name, t in self._tables.items():
+                for k, v in t.columns.items():
+                    _save(snapshot_dir / f"{table_name}.{k}", v)
+                for k, v in t.categories.items():
+                    _save(snapshot_dir / f"{table_name}.{k}.categories", v)
+                meta[table_name] = {"index": t.index, "types": t.types, "rows": len(t)}
+        tmp = snapshot_dir / f"{self._meta_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(tmp, snapshot_dir / self._meta_file)
+        log.info(f"snapshot {list(meta)} to {snapshot_dir}")
+
+    def restore(self, snapshot_dir: str, mmap: bool=True):
+        """ Load tables saved by `snapshot`, memory-mapped if `mmap` is True.
+        Object arrays, e.g. "null" columns and str categories, are pickled
+        by `np.save` and can't be mapped; they are read into memory.
+        """
+        snapshot_dir = Path(snapshot_dir)
+        with open(snapshot_dir / self._meta_file, "r") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        for table_name, m in meta.items():
+            t = _MemoryTable(index=m["index"], types=m["types"], block_number_col=self._block_number_col)
+            if m["rows"] > 0:
+                t.columns = {k: _load(snapshot_dir / f"{table_name}.{k}", mmap_mode=mmap_mode) for k in t.types}
+            for k in t.categories:
+                t.categories[k] = _load(snapshot_dir / f"{table_name}.{k}.categories")
+                t.codes[k] = {v: i for i, v in enumerate(t.categories[k])}
+            self._tables[table_name] = t
+        log.info(f"restored {list(meta)} from {snapshot_dir}, mmap = {mmap}")
+
+
+def _save(stem: Path, values: np.ndarray):
+    """ Save `values` to `<stem>.npy` through a temporary file.
+    """
+    tmp = stem.with_name(f"{stem.name}.tmp.npy")
+    np.save(tmp, values)
+    os.replace(tmp, stem.with_name(f"{stem.name}.npy"))
+
+
+def _load(stem: Path, mmap_mode: Optional[str]=None) -> np.ndarray:
+    """ Load `<stem>.npy` saved by `_save`; object arrays are unpickled into
+    memory, since only plain dtypes can be memory-mapped.
+    """
+    path = stem.with_name(f"{stem.name}.npy")
+    with open(path, "rb") as f:
+        read_header = np.lib.format.read_array_header_1_0 if np.lib.format.read_magic(f) == (1, 0) else np.lib.format.read_array_header_2_0
+        _, _, dtype = read_header(f)
+    if dtype.hasobject:
+        return np.load(path, allow_pickle=True) # our own snapshot files
+    return np.load(path, mmap_mode=mmap_mode)
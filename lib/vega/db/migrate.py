@@ -0,0 +1,292 @@
+"""
+Streaming copy of a table from one DataBase backend to another.
+"""
+import os
+import json
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Optional, Tuple, Iterator
+
+from . import DataBase, log
+from ..utils import IntervalSet
+
+
+__all__ = [
+    "copy_table",
+    "verify_table",
+    "block_bounds",
+    "key_checksum",
+]
+
+
+def block_bounds(d: DataBase, table_name: str, block_number_col: str="blockNumber") -> Optional[Tuple[int, int]]:
+    """ (min, max) block number of `table_name`, None if it's empty.
+    """
+    first = d.query(table_name, columns=[block_number_col], order_by=block_number_col, limit=1)
+    if len(first) == 0:
+        return None
+    last = d.query(table_name, columns=[block_number_col], order_by=f"-{block_number_col}", limit=1)
+    return int(first.iloc[0, 0]), int(last.iloc[0, 0])
+
+
+def key_checksum(df: pd.DataFrame, index: List[str]) -> int:
+    """ Order-independent checksum of the `index` columns: the sum of the
+    row hashes modulo 2**64. Keys are hashed as str so that the same rows
+    read from different backends give the same checksum.
+    """
+    if len(df) == 0:
+        return 0
+    h = pd.util.hash_pandas_object(df[index].astype(str), index=False).to_numpy(dtype=np.uint64)
+    return int(h.sum(dtype=np.uint64)) # wraps around
+
+
+def _windows(block_range: Tuple[int, int], window_blocks: int) -> List[Tuple[int, int]]:
+    start, end = block_range
+    return [(s, min(s + window_blocks, end)) for s in range(start, end, window_blocks)]
+
+
+def _read_page(src: DataBase,
+               table_name: str,
+               window: Tuple[int, int],
+               *,
+               block_number_col: str,
+               max_rows: int,
+               columns: Optional[List[str]]=None) -> Tuple[pd.DataFrame, Optional[int]]:
+    """ The first whole blocks of `window` with at most `max_rows` rows, or
+    the first block alone if it has more; and the block to read the rest of
+    `window` from, None if there's no rest.
+    """
+    start, end = window
+    df = src.query(table_name, columns=columns, block_range=window, order_by=block_number_col, limit=max_rows)
+    if len(df) < max_rows:
+        return df, None
+    blocks = df[block_number_col].astype("int64")
+    last = int(blocks.max())
+    if last > start: # the last block may be cut off by the limit, read it with the rest
+        return df[blocks < last], last
+    df = src.query(table_name, columns=columns, block_range=(start, start + 1))
+    return df, start + 1 if start + 1 < end else None
+
+
+def _iter_window(src: DataBase,
+                 table_name: str,
+                 window: Tuple[int, int],
+                 *,
+                 block_number_col: str,
+                 max_rows: int,
+                 columns: Optional[List[str]]=None,
+                 first: Optional[Tuple[pd.DataFrame, Optional[int]]]=None) -> Iterator[pd.DataFrame]:
+    """ Read `window` page by page, see `_read_page`; `first` is the first page if already read.
+    """
+    kw = dict(block_number_col=block_number_col, max_rows=max_rows, columns=columns)
+    df, rest = first if first is not None else _read_page(src, table_name, window, **kw)
+    yield df
+    while rest is not None:
+        df, rest = _read_page(src, table_name, (rest, window[1]), **kw)
+        yield df
+
+
+def _resolve_range(src: DataBase,
+                   table_name: str,
+                   block_range: Optional[Tuple[Optional[int], Optional[int]]],
+                   block_number_col: str) -> Optional[Tuple[int, int]]:
+    """ `block_range` with missing ends filled from the table; None if there's nothing to copy.
+    """
+    bounds = block_bounds(src, table_name, block_number_col)
+    if bounds is None:
+        return None
+    start, end = block_range if block_range is not None else (None, None)
+    start = bounds[0] if start is None else max(int(start), bounds[0])
+    end = bounds[1] + 1 if end is None else min(int(end), bounds[1] + 1)
+    return (start, end) if start < end else None
+
+
+def _has_block_number(src: DataBase, table_name: str, block_number_col: str) -> bool:
+    return block_number_col in src.query(table_name, limit=1).columns
+
+
+class _Checkpoint:
+    """ Block windows already copied, as a JSON file of inclusive ranges.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]], key: str):
+        self._path = Path(path) if path is not None else None
+        self._key = key
+        self.done = IntervalSet()
+        self.rows = 0
+        if self._path is not None and self._path.exists():
+            with open(self._path, "r") as f:
+                ck = json.load(f)
+            assert ck["key"] == key, f"checkpoint {self._path} is for {ck['key']}, not {key}"
+            self.done = IntervalSet(ck["done"])
+            self.rows = ck["rows"]
+            log.info(f"resuming from checkpoint {self._path}: {self.done}, {self.rows} rows copied")
+
+    def add(self, window: Tuple[int, int], rows: int):
+        self.done.add(window[0], window[1] - 1)
+        self.rows += rows
+        if self._path is None:
+            return
+        tmp = self._path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"key": self._key, "done": list(self.done), "rows": self.rows}, f, indent=4)
+        os.replace(tmp, self._path)
+
+
+def copy_table(src: DataBase,
+               dst: DataBase,
+               table_name: str,
+               *,
+               index: Union[str, List[str]],
+               dst_table_name: Optional[str]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               block_number_col: str="blockNumber",
+               window_blocks: int=100_000,
+               max_rows: int=200_000,
+               workers: int=1,
+               checkpoint: Optional[Union[str, Path]]=None,
+               verify: bool=True,
+               ) -> dict:
+    """ Copy `table_name` from `src` to `dst`, one block window at a time.
+
+    Windows are read in pages of at most `max_rows` rows, split at block
+    boundaries (a single block is never split). The first page of each
+    window is read by `workers` threads, the rest while writing it; pages
+    are written to `dst` in block order from the calling thread, with at
+    most 2 * `workers` + 1 pages held in memory. Each written window is
+    recorded in `checkpoint`, so an interrupted copy resumes where it
+    stopped. Tables without a block number column are copied in one piece.
+
+    Parameters
+    ----------
+    block_range : (start, end), optional
+        Copy rows with start <= block number < end; either end can be None.
+    max_rows : int
+        Rows per read; this, not `window_blocks`, bounds the memory used.
+    workers : int
+        Parallel readers. For SQLiteDB sources, connect with
+        `read_pool_size >= workers` so they don't share a connection.
+    verify : bool
+        Compare row counts and key checksums afterwards, see `verify_table`.
+
+    Returns
+    -------
+    dict with the rows copied, and the `verify_table` report if `verify`.
+    """
+    if isinstance(index, str):
+        index = [index]
+    dst_table_name = dst_table_name or table_name
+    report = {"table_name": table_name, "dst_table_name": dst_table_name}
+
+    def write(df: pd.DataFrame):
+        res = dst.write(df, table_name=dst_table_name, index=index)
+        if hasattr(res, "result"): # SQLiteDB writer queue
+            res.result()
+
+    if not _has_block_number(src, table_name, block_number_col):
+        df = src.query(table_name)
+        write(df)
+        report["rows"] = len(df)
+        log.info(f"copied {len(df)} rows of {table_name} in one piece")
+    else:
+        full_range = _resolve_range(src, table_name, block_range, block_number_col)
+        ck = _Checkpoint(checkpoint, key=f"{table_name}->{dst_table_name}")
+        windows = [] if full_range is None else [
+            _ for _ in _windows(full_range, window_blocks) if not ck.done.covers(_[0], _[1] - 1)]
+        log.info(f"copying {table_name} blocks {full_range} in {len(windows)} windows of {window_blocks} blocks, workers = {workers}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            read = lambda window, first: _iter_window(src, table_name, window, block_number_col=block_number_col, max_rows=max_rows, first=first)
+            for window in windows:
+                pending.append((window, executor.submit(
+                    _read_page, src, table_name, window, block_number_col=block_number_col, max_rows=max_rows)))
+                if len(pending) < 2 * workers:
+                    continue
+                _copy_window(pending.popleft(), read, write, ck)
+            while pending:
+                _copy_window(pending.popleft(), read, write, ck)
+        report["rows"] = ck.rows
+
+    if verify:
+        report["verify"] = verify_table(
+            src, dst, table_name,
+            index=index,
+            dst_table_name=dst_table_name,
+            block_range=block_range,
+            block_number_col=block_number_col,
+            window_blocks=window_blocks,
+            max_rows=max_rows,
+            workers=workers)
+    return report
+
+
+def _copy_window(item: tuple, read, write, ck: _Checkpoint):
+    window, future = item
+    rows = 0
+    for df in read(window, future.result()):
+        if len(df) > 0:
+            write(df)
+        rows += len(df)
+    ck.add(window, rows)
+    log.info(f"copied blocks [{window[0]}, {window[1]}): {rows} rows, {ck.rows} in total")
+
+
+def verify_table(src: DataBase,
+                 dst: DataBase,
+                 table_name: str,
+                 *,
+                 index: Union[str, List[str]],
+                 dst_table_name: Optional[str]=None,
+                 block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                 block_number_col: str="blockNumber",
+                 window_blocks: int=100_000,
+                 max_rows: int=200_000,
+                 workers: int=1,
+                 ) -> dict:
+    """ Compare row counts and key checksums (see `key_checksum`) of
+    `table_name` in `src` and `dst_table_name` in `dst`, window by window,
+    reading only the index columns, `max_rows` rows at a time.
+    """
+    if isinstance(index, str):
+        index = [index]
+    dst_table_name = dst_table_name or table_name
+
+    def summarize(d: DataBase, name: str, window: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+        if window is None:
+            df = d.query(name, columns=index)
+            return len(df), key_checksum(df, index)
+        n, checksum = 0, 0
+        columns = list(dict.fromkeys(index + [block_number_col]))
+        for df in _iter_window(d, name, window, block_number_col=block_number_col, max_rows=max_rows, columns=columns):
+            n += len(df)
+            checksum = (checksum + key_checksum(df, index)) % 2**64
+        return n, checksum
+
+    if _has_block_number(src, table_name, block_number_col):
+        full_range = _resolve_range(src, table_name, block_range, block_number_col)
+        windows = [] if full_range is None else _windows(full_range, window_blocks)
+    else:
+        windows = [None]
+
+    report = {"rows_src": 0, "rows_dst": 0, "checksum_src": 0, "checksum_dst": 0, "mismatched_windows": []}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for window, (n_src, c_src), (n_dst, c_dst) in zip(
+                windows,
+                executor.map(lambda w: summarize(src, table_name, w), windows),
+                executor.map(lambda w: summarize(dst, dst_table_name, w), windows)):
+            report["rows_src"] += n_src
+            report["rows_dst"] += n_dst
+            report["checksum_src"] = (report["checksum_src"] + c_src) % 2**64
+            report["checksum_dst"] = (report["checksum_dst"] + c_dst) % 2**64
+            if (n_src, c_src) != (n_dst, c_dst):
+                report["mismatched_windows"].append(window)
+    report["ok"] = not report["mismatched_windows"]
+    if report["ok"]:
+        log.info(f"verified {table_name}: {report['rows_src']} rows, checksum {report['checksum_src']:016x}")
+    else:
+        log.error(f"{table_name} differs in {len(report['mismatched_windows'])} windows: {report['mismatched_windows'][:10]}")
+    return report
@@ -0,0 +1,421 @@
+import os
+import json
+import threading
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Union, List, Optional, Dict, Tuple, Any
+
+from . import DataBase, log, is_multi_value, sort_and_limit, parse_order_by
+from .codec import infer_schema, widen_schema, encode_int256, decode_int256, encode_hex, decode_hex
+
+
+__all__ = [
+    "ParquetDB",
+]
+
+
+class ParquetDB(DataBase):
+    """ Tables stored as Parquet files under `root_dir`, one directory per
+    table, partitioned by block range:
+
+        <root_dir>/<table_name>/_meta.json
+        <root_dir>/<table_name>/blockNumber=<start>-<end>.<part>.parquet
+
+    `_meta.json` records the index, the column types (see codec.py) and
+    per-partition block bounds and part files, so reads with a block range
+    only open the overlapping partitions. Tables without a block number
+    column are kept in a single partition.
+
+    Each write appends one part file per partition it touches instead of
+    rewriting the partition. Rows are deduplicated by index across parts
+    on read, the last write wins. `compact` merges the parts of a
+    partition into one file; it runs on its own once a partition has
+    `max_parts` parts.
+    """
+
+    _meta_file = "_meta.json"
+
+    def init(self,
+             root_dir: str,
+             partition_blocks: int=100_000,
+             block_number_col: str="blockNumber",
+             compression: str="zstd",
+             binary_hex: bool=False,
+             max_parts: int=32):
+        """ If `binary_hex` is True, new tables store address and hash columns
+        as raw bytes, see codec.py.
+        """
+        self._binary_hex = binary_hex
+        self._root_dir = Path(root_dir)
+        self._partition_blocks = partition_blocks
+        self._block_number_col = block_number_col
+        self._compression = compression
+        self._max_parts = max_parts
+        self._lock = threading.Lock()
+        self._root_dir.mkdir(parents=True, exist_ok=True)
+        log.info(f"opened parquet database at {self._root_dir}, partition_blocks = {partition_blocks}")
+
+    @property
+    def root_dir(self) -> Path:
+        return self._root_dir
+
+    def table_exists(self, table_name: str) -> bool:
+        return (self._root_dir / table_name / self._meta_file).exists()
+
+    def create_table(self, *,
+                     table_name: str,
+                     columns: List[str],
+                     index: Union[str, List[str]],
+                     types: Optional[Dict[str, str]]=None):
+        if isinstance(index, str):
+            index = [index]
+        assert all([_ in columns for _ in index]), f"not all of {index} are found in {columns}"
+        assert not self.table_exists(table_name), f"table {table_name} already exists"
+        if types is None:
+            types = {k: "str" for k in columns}
+        (self._root_dir / table_name).mkdir(parents=True, exist_ok=True)
+        self._dump_meta(table_name, {
+            "index": index,
+            "types": {k: types[k] for k in columns},
+            "partitioned": self._block_number_col in columns,
+            "partitions": {},
+            "next_part": 0,
+        })
+        log.info(f"created table {table_name} at {self._root_dir}; index = {index}; types = {types}")
+
+    def meta(self, table_name: str) -> dict:
+        with open(self._root_dir / table_name / self._meta_file, "r") as f:
+            return json.load(f)
+
+    def _dump_meta(self, table_name: str, meta: dict):
+        path = self._root_dir / table_name / self._meta_file
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(tmp, path)
+
+    def write(self,
+              df: pd.DataFrame,
+              *,
+              table_name: str,
+              index: Union[str, List[str]],
+              types: Optional[Dict[str, str]]=None,
+              update: bool=True):
+        """ Append `df` as one new part file per partition it falls in.
+        Rows replace those with the same index on read, whatever `update`
+        is; it's accepted as in `MemoryDB.write`.
+        Column types are inferred or declared in `types` as in `SQLiteDB.write`.
+        """
+        if not self.table_exists(table_name):
+            self.create_table(table_name=table_name, columns=list(df.columns), index=index,
+                              types=infer_schema(df, binary_hex=self._binary_hex, types=types))
+        with self._lock:
+            meta = self.meta(table_name)
+            missing = [v for v in df.columns if v not in meta["types"]]
+            assert not missing, f"columns {missing} are not found in {table_name} schema {meta['types']}"
+            widened = widen_schema(meta["types"], df, binary_hex=self._binary_hex, types=types)
+            if widened:
+                self._widen_columns(table_name, meta, widened)
+            df = _encode_frame(df, meta["types"])
+            if meta["partitioned"]:
+                keys = df[self._block_number_col].astype("int64") // self._partition_blocks * self._partition_blocks
+                groups = df.groupby(keys.to_numpy())
+            else:
+                groups = [(None, df)]
+            touched = []
+            for start, df_part in groups:
+                name = self._partition_name(start)
+                df_part = df_part.drop_duplicates(subset=meta["index"], keep="last").sort_values(meta["index"])
+                part = self._new_part(meta, start)
+                self._write_file(self._root_dir / table_name / part, df_part)
+                stats = meta["partitions"].setdefault(name, {"rows": 0, "parts": []})
+                stats["parts"] = _parts(name, stats) + [part]
+                stats["rows"] += len(df_part) # before deduplication across parts
+                if meta["partitioned"]:
+                    stats["min_block"] = min(int(df_part[self._block_number_col].min()), stats.get("min_block", np.iinfo(np.int64).max))
+                    stats["max_block"] = max(int(df_part[self._block_number_col].max()), stats.get("max_block", -1))
+                touched.append(name)
+            self._dump_meta(table_name, meta)
+            for name in touched:
+                if len(meta["partitions"][name]["parts"]) >= self._max_parts:
+                    self._compact_partition(table_name, meta, name)
+        log.info(f"{len(df)} rows are written to {self._root_dir}:{table_name}.")
+
+    def compact(self, table_name: str, min_parts: int=2) -> int:
+        """ Merge the part files of each partition with at least `min_parts`
+        parts into one; return the number of partitions compacted.
+        """
+        n = 0
+        with self._lock:
+            meta = self.meta(table_name)
+            for name, stats in list(meta["partitions"].items()):
+                if len(_parts(name, stats)) >= min_parts:
+                    self._compact_partition(table_name, meta, name)
+                    n += 1
+        log.info(f"compacted {n} partitions of {table_name}")
+        return n
+
+    def _compact_partition(self, table_name: str, meta: dict, name: str):
+        """ Rewrite partition `name` as one deduplicated part; files of the
+        old parts are removed after the meta file stops listing them.
+        """
+        stats = meta["partitions"][name]
+        old_parts = _parts(name, stats)
+        df = self._read_parts(table_name, old_parts, meta["index"])
+        start = int(name.split("=")[1].split("-")[0]) if meta["partitioned"] else None
+        part = self._new_part(meta, start)
+        self._write_file(self._root_dir / table_name / part, df.sort_values(meta["index"]))
+        stats.update(self._stats(df, meta))
+        stats["parts"] = [part]
+        self._dump_meta(table_name, meta)
+        for _ in old_parts:
+            (self._root_dir / table_name / _).unlink(missing_ok=True)
+        log.debug(f"compacted {len(old_parts)} parts of {table_name}/{name}")
+
+    def _stats(self, df: pd.DataFrame, meta: dict) -> dict:
+        stats = {"rows": len(df)}
+        if meta["partitioned"] and len(df) > 0:
+            stats["min_block"] = int(df[self._block_number_col].min())
+            stats["max_block"] = int(df[self._block_number_col].max())
+        return stats
+
+    def _read_parts(self,
+                    table_name: str,
+                    parts: List[str],
+                    index: List[str],
+                    columns: Optional[List[str]]=None,
+                    filters: Optional[list]=None,
+                    ) -> pd.DataFrame:
+        """ Read and concatenate `parts`, dropping rows overwritten by a later part.
+        """
+        paths = [self._root_dir / table_name / _ for _ in parts]
+        if len(paths) == 1:
+            return pq.read_table(paths[0], columns=columns, filters=filters).to_pandas()
+        df = pd.concat([pq.read_table(_, columns=columns, filters=filters).to_pandas() for _ in paths], ignore_index=True)
+        return df.drop_duplicates(subset=index, keep="last", ignore_index=True)
+
+    def _new_part(self, meta: dict, start: Optional[int]) -> str:
+        seq = meta.get("next_part", 0)
+        meta["next_part"] = seq + 1
+        return self._partition_name(start).replace(".parquet", f".{seq:06d}.parquet")
+
+    def _write_file(self, path: Path, df: pd.DataFrame):
+        tmp = path.with_suffix(".tmp")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression=self._compression)
+        os.replace(tmp, path)
+
+    def _widen_columns(self, table_name: str, meta: dict, types: Dict[str, str]):
+        """ Change column types in `meta` to `types`, see `widen_type`;
+        part files with "int" columns widened to "int256" are rewritten.
+        """
+        reencode = [k for k, v in types.items() if meta["types"][k] == "int" and v == "int256"]
+        if reencode:
+            for name, stats in meta["partitions"].items():
+                for part in _parts(name, stats):
+                    path = self._root_dir / table_name / part
+                    df = pq.read_table(path).to_pandas()
+                    df = pd.concat([df.drop(columns=reencode), _encode_frame(df[reencode], {k: "int256" for k in reencode})], axis=1)[df.columns]
+                    self._write_file(path, df)
+        meta["types"].update(types)
+        self._dump_meta(table_name, meta)
+        log.info(f"widened columns of {table_name}: {types}")
+
+    def _partition_name(self, start: Optional[int]) -> str:
+        if start is None:
+            return "all.parquet"
+        end = int(start) + self._partition_blocks - 1
+        return f"{self._block_number_col}={int(start):012d}-{end:012d}.parquet"
+
+    def read_table(self,
+                   table_name: str,
+                   *,
+                   columns: Optional[List[str]]=None,
+                   where: Optional[Dict[str, Any]]=None,
+                   block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                   ) -> pd.DataFrame:
+        """ Read `table_name`, opening only the partitions that overlap `block_range`.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to read, all if None.
+        where : dict, optional
+            {column: value} equality, or {column: [values]} membership,
+            pushed down to the Parquet reader, e.g. {"address": pool}.
+        block_range : (start, end), optional
+            Keep rows with start <= block number < end; either end can be None.
+        """
+        try:
+            return self._read_table(table_name, columns=columns, where=where, block_range=block_range)
+        except FileNotFoundError: # parts compacted away since the meta file was read
+            return self._read_table(table_name, columns=columns, where=where, block_range=block_range)
+
+    def _read_table(self,
+                    table_name: str,
+                    *,
+                    columns: Optional[List[str]]=None,
+                    where: Optional[Dict[str, Any]]=None,
+                    block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                    ) -> pd.DataFrame:
+        meta = self.meta(table_name)
+        types = meta["types"]
+        filters = []
+        for k, v in (where or {}).items():
+            if is_multi_value(v):
+                filters.append((k, "in", [_encode_value(_, types[k]) for _ in v]))
+            else:
+                filters.append((k, "==", _encode_value(v, types[k])))
+        start, end = block_range if block_range is not None else (None, None)
+        if start is not None:
+            filters.append((self._block_number_col, ">=", int(start)))
+        if end is not None:
+            filters.append((self._block_number_col, "<", int(end)))
+
+        frames = []
+        for name, stats in sorted(meta["partitions"].items()):
+            if start is not None and "max_block" in stats and stats["max_block"] < start:
+                continue
+            if end is not None and "min_block" in stats and stats["min_block"] >= end:
+                continue
+            parts = _parts(name, stats)
+            if len(parts) == 1:
+                frames.append(self._read_parts(table_name, parts, meta["index"], columns=columns, filters=filters or None))
+                continue
+            # filter after deduplication, an overwritten row may match where its replacement doesn't
+            read_columns = None if columns is None else list(dict.fromkeys(columns + meta["index"] + [f[0] for f in filters]))
+            df = self._read_parts(table_name, parts, meta["index"], columns=read_columns)
+            df = df[_mask(df, filters)]
+            frames.append(df[columns] if columns is not None else df)
+        log.info(f"read {len(frames)} of {len(meta['partitions'])} partitions of {table_name}")
+        if not frames:
+            return pd.DataFrame(columns=columns or list(types))
+        return _decode_frame(pd.concat(frames, ignore_index=True), types)
+
+    def query(self,
+              table_name: str,
+              *,
+              columns: Optional[List[str]]=None,
+              where: Optional[Dict[str, Any]]=None,
+              block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+              order_by: Optional[Union[str, List[str]]]=None,
+              limit: Optional[int]=None,
+              ) -> pd.DataFrame:
+        """ See `DataBase.query`. Partition pruning, `where` and projection are
+        pushed down to the reader; ordering and limit are applied after.
+        """
+        read_columns = None if columns is None else list(dict.fromkeys(columns + [k for k, _ in parse_order_by(order_by)]))
+        df = self.read_table(table_name, columns=read_columns, where=where, block_range=block_range)
+        return sort_and_limit(df, columns=columns, order_by=order_by, limit=limit)
+
+    def delete(self,
+               table_name: str,
+               *,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> int:
+        """ Partitions with matching rows are rewritten as one part without them.
+        """
+        assert where or block_range, "refusing to delete without conditions"
+        n = 0
+        with self._lock:
+            meta = self.meta(table_name)
+            types = meta["types"]
+            filters = [(k, "in", [_encode_value(_, types[k]) for _ in (list(v) if is_multi_value(v) else [v])]) for k, v in (where or {}).items()]
+            start, end = block_range if block_range is not None else (None, None)
+            if start is not None:
+                filters.append((self._block_number_col, ">=", int(start)))
+            if end is not None:
+                filters.append((self._block_number_col, "<", int(end)))
+            for name in list(meta["partitions"]):
+                stats = meta["partitions"][name]
+                if start is not None and "max_block" in stats and stats["max_block"] < start:
+                    continue
+                if end is not None and "min_block" in stats and stats["min_block"] >= end:
+                    continue
+                old_parts = _parts(name, meta["partitions"][name])
+                df = self._read_parts(table_name, old_parts, meta["index"])
+                mask = _mask(df, filters)
+                if not mask.any():
+                    continue
+                n += int(mask.sum())
+                df = df[~mask]
+                if len(df) == 0:
+                    meta["partitions"].pop(name)
+                else:
+                    start = int(name.split("=")[1].split("-")[0]) if meta["partitioned"] else None
+                    part = self._new_part(meta, start)
+                    self._write_file(self._root_dir / table_name / part, df)
+                    meta["partitions"][name] = {**self._stats(df, meta), "parts": [part]}
+                self._dump_meta(table_name, meta)
+                for _ in old_parts:
+                    (self._root_dir / table_name / _).unlink(missing_ok=True)
+        log.info(f"deleted {n} rows from {table_name} where {where}, block_range = {block_range}")
+        return n
+
+    def delete_table(self, table_name: str) -> bool:
+        """ Return True if deleted is done.
+        """
+        while True:
+            cmd = input(f"delete {table_name}? (yes/no)")
+            if cmd == "yes":
+                import shutil
+                shutil.rmtree(self._root_dir / table_name)
+                return True
+            elif cmd == "no":
+                return False
+
+
+def _parts(name: str, stats: dict) -> List[str]:
+    """ Part files of partition `name`; tables written before part files have the partition file only.
+    """
+    return stats.get("parts", [name])
+
+
+def _mask(df: pd.DataFrame, filters: List[tuple]) -> np.ndarray:
+    """ Evaluate reader-style `filters` of ==, in, >= and < on `df`.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for k, op, v in filters:
+        if op == "==":
+            mask &= df[k].isin([v]).to_numpy()
+        elif op == "in":
+            mask &= df[k].isin(v).to_numpy()
+        elif op == ">=":
+            mask &= (df[k] >= v).to_numpy()
+        elif op == "<":
+            mask &= (df[k] < v).to_numpy()
+    return mask
+
+
+def _encode_value(x: Any, column_type: str) -> Any:
+    if column_type == "int256":
+        return encode_int256(x)
+    elif column_type in ("address", "hash"):
+        return encode_hex(x)
+    return x
+
+
+def _encode_frame(df: pd.DataFrame, types: Dict[str, str]) -> pd.DataFrame:
+    """ int256, address and hash columns become binary (see codec.py), str columns become str.
+    """
+    df = df.copy()
+    for v in df.columns:
+        if types[v] == "int256":
+            df[v] = pd.Series([None if pd.isna(x) else encode_int256(x) for x in df[v]], index=df.index, dtype=object)
+        elif types[v] in ("address", "hash"):
+            df[v] = pd.Series([None if pd.isna(x) else encode_hex(x) for x in df[v]], index=df.index, dtype=object)
+        elif types[v] == "str":
+            df[v] = df[v].astype(str)
+    return df
+
+
+def _decode_frame(df: pd.DataFrame, types: Dict[str, str]) -> pd.DataFrame:
+    for v in df.columns:
+        if types.get(v) == "int256":
+            df[v] = pd.Series([None if x is None else decode_int256(x) for x in df[v]], index=df.index, dtype=object)
+        elif types.get(v) in ("address", "hash"):
+            df[v] = pd.Series(decode_hex(df[v], types[v]), index=df.index, dtype=object)
+    return df
@@ -1,11 +1,15 @@
 import os
+import time
 import sqlite3
 import json
-from . import log
+from contextlib import contextmanager
+from . import DataBase, log, is_multi_value, parse_order_by
 import pandas as pd
 import numpy as np
-from typing import Union, List, Optional, Any
+from typing import Union, List, Optional, Any, Dict, Iterator, Tuple, Callable
 from pandas.api.types import is_string_dtype
+from .sqlite_pool import SQLiteReadPool, SQLiteWriter
+from .codec import infer_schema, widen_schema, encode_int256, decode_int256, encode_hex, decode_hex, datetime_to_ns, ns_to_datetime
 
 
 __all__ = [
@@ -13,14 +17,173 @@ __all__ = [
 ]
 
 
-class SQLiteDB:
+_SQLITE_TYPES = {
+    "bool": "INTEGER",
+    "int": "INTEGER",
+    "float": "REAL",
+    "int256": "BLOB", # 32-byte offset binary, see codec.py
+    "datetime": "INTEGER", # ns since epoch
+    "address": "BLOB", # 20 bytes
+    "hash": "BLOB", # 32 bytes
+    "str": "TEXT",
+    "null": "", # no affinity, so the type resolved later is stored as is
+}
+
+
+def _encode_column(s: pd.Series, column_type: str) -> np.ndarray:
+    """ Convert `s` to python values sqlite3 can bind, None for nulls.
+    """
+    notnull = s.notna().to_numpy()
+    v = s[notnull]
+    if column_type == "bool":
+        encoded = v.astype(bool).astype("int64").tolist()
+    elif column_type == "int":
+        encoded = v.astype("int64").tolist()
+    elif column_type == "float":
+        encoded = v.astype("float64").tolist()
+    elif column_type == "int256":
+        encoded = [encode_int256(x) for x in v]
+    elif column_type == "datetime":
+        encoded = datetime_to_ns(v).astype("int64").tolist()
+    elif column_type in ("address", "hash"):
+        encoded = [encode_hex(x) for x in v]
+    elif column_type == "str":
+        encoded = v.astype(str).tolist()
+    elif column_type == "null":
+        encoded = v.tolist()
+    else:
+        raise ValueError(f"unsupported column type {column_type}")
+    res = np.full(len(s), None, dtype=object)
+    res[notnull] = np.array(encoded, dtype=object)
+    return res
+
+
+def _decode_column(s: pd.Series, column_type: str) -> pd.Series:
+    """ Inverse of `_encode_column` on what `pd.read_sql_query` returns.
+    """
+    has_null = bool(s.isna().any())
+    if column_type == "bool":
+        return s.astype("boolean") if has_null else s.astype(bool)
+    elif column_type == "int":
+        return s if has_null else s.astype("int64")
+    elif column_type == "float":
+        return s.astype("float64")
+    elif column_type == "int256":
+        return pd.Series([None if x is None else decode_int256(x) for x in s], index=s.index, dtype=object)
+    elif column_type == "datetime":
+        return ns_to_datetime(s)
+    elif column_type in ("address", "hash"):
+        return pd.Series(decode_hex(s, column_type), index=s.index, dtype=object)
+    else:
+        return s
+
+
+class SQLiteDB(DataBase):
     
     _con: sqlite3.Connection
+    _read_pool: Optional[SQLiteReadPool] = None
+    _writer: Optional[SQLiteWriter] = None
+    _ingest_pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "temp_store": "MEMORY",
+    }
    
-    def connect(self, path: str, **kw):
+    _schema_table = "_vega_schema"
+
+    def connect(self,
+                path: str,
+                ingest_profile: bool=False,
+                read_pool_size: int=0,
+                writer_queue: bool=False,
+                writer_batch_size: int=64,
+                binary_hex: bool=False,
+                read_timeout: Optional[float]=30.,
+                **kw):
+        """ Connect to `path`.
+
+        Parameters
+        ----------
+        ingest_profile : bool
+            Tune the connection for bulk ingestion, see `set_ingest_profile`.
+        read_pool_size : int
+            If > 0, reads go through a pool of that many read-only connections,
+            waiting at most `read_timeout` seconds for one to be idle.
+        writer_queue : bool
+            If True, `write` hands rows to a dedicated writer thread that
+            commits queued writes in batches of up to `writer_batch_size`,
+            and returns a Future of the number of rows written. Tables,
+            indexes, schema records and deletes are written by that thread
+            too, so there's a single writer.
+        binary_hex : bool
+            If True, new tables store address and hash columns as BLOBs,
+            see codec.py. Existing tables keep their recorded types.
+        """
         self._path = path
+        self._binary_hex = binary_hex
+        self._schemas = {}
+        self._str_column_types = {} # detected types of legacy TEXT tables
+        self._pending_indexes = {} # declared before the table exists
         self._con = sqlite3.connect(path, check_same_thread=False, **kw)
         log.info(f"connected to {path}")
+        if ingest_profile is True:
+            self.set_ingest_profile()
+        if read_pool_size > 0 or writer_queue is True:
+            self.execute("PRAGMA journal_mode=WAL") # so that readers don't block behind commits
+        if read_pool_size > 0:
+            self._read_pool = SQLiteReadPool(path, size=read_pool_size, acquire_timeout=read_timeout, **kw)
+        if writer_queue is True:
+            self._writer = SQLiteWriter(path, batch_size=writer_batch_size, **kw)
+
+    def init(self, path: str, **kw):
+        """ Same as `connect`, for the DataBase interface.
+        """
+        self.connect(path, **kw)
+
+    def close(self):
+        """ Drain the writer queue and close all connections.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._read_pool is not None:
+            self._read_pool.close()
+            self._read_pool = None
+        self.con.close()
+        log.info(f"closed {self._path}")
+
+    def flush(self):
+        """ Block until queued writes are committed.
+        """
+        if self._writer is not None:
+            self._writer.flush()
+
+    def pool_stats(self) -> dict:
+        """ Read pool wait-time and writer queue statistics.
+        """
+        return {
+            "read_pool": self._read_pool.stats() if self._read_pool is not None else None,
+            "writer": self._writer.stats() if self._writer is not None else None,
+        }
+
+    @contextmanager
+    def read_connection(self):
+        """ A pooled read-only connection if the pool is enabled, otherwise `con`.
+        """
+        if self._read_pool is None:
+            yield self.con
+        else:
+            with self._read_pool.connection() as con:
+                yield con
+
+    def set_ingest_profile(self, cache_size_mb: int=256):
+        """ Tune the connection for bulk ingestion: WAL journal,
+        synchronous=NORMAL and a larger page cache.
+        """
+        for k, v in self._ingest_pragmas.items():
+            self.execute(f"PRAGMA {k}={v}")
+        self.execute(f"PRAGMA cache_size=-{int(cache_size_mb) * 1024}") # negative means KiB
+        log.info(f"ingest profile set on {self._path}: {self._ingest_pragmas}, cache_size={cache_size_mb}MB")
 
     @property
     def con(self) -> sqlite3.Connection:
@@ -30,42 +193,357 @@ class SQLiteDB:
               df: pd.DataFrame,
               *,
               table_name: str,
-              index: Union[str, List[str]]):
-
-        df = df.astype(str)
+              index: Union[str, List[str]],
+              chunk_size: int=50_000,
+              types: Optional[Dict[str, str]]=None,
+              update: bool=True):
+        """ Write `df` in one transaction, `chunk_size` rows per `executemany`.
+        Rows replace those with the same index, whatever `update` is; it's
+        accepted as in `MemoryDB.write`.
+        New tables are created with column types inferred from `df`, or
+        declared in `types`; columns that can't hold the values of `df`
+        are widened first, see `widen_schema`.
+        With the writer queue enabled, return a Future of the rows written.
+        """
         if not self.table_exists(table_name):
-            self.create_table(table_name=table_name, columns=list(df.columns), index=index)
+            self.create_table(table_name=table_name, columns=list(df.columns), index=index,
+                              types=infer_schema(df, binary_hex=self._binary_hex, types=types))
+        schema = self.schema(table_name)
+        if schema is None: # legacy all-TEXT table
+            columns = [df[v].astype(str).to_numpy(dtype=object) for v in df.columns]
+        else:
+            missing = [v for v in df.columns if v not in schema]
+            assert not missing, f"columns {missing} are not found in {table_name} schema {schema}"
+            widened = widen_schema(schema, df, binary_hex=self._binary_hex, types=types)
+            if widened:
+                self.widen_columns(table_name, widened)
+                schema = self.schema(table_name)
+            columns = [_encode_column(df[v], schema[v]) for v in df.columns]
 
         query = "REPLACE INTO {} ({}) VALUES ({}) ".format(table_name, ', '.join(df.columns), ', '.join(["?"]*len(df.columns)))
-        for i in range(len(df)):
-            self.execute(query, tuple(df.iloc[i]))
-        self.con.commit()
-        log.info(f"{len(df)} rows are written to {self._path}:{table_name}.")
+        n = len(df)
+
+        def write_rows(con: sqlite3.Connection) -> int:
+            start = time.perf_counter()
+            for i in range(0, n, chunk_size):
+                rows = zip(*[c[i:i + chunk_size] for c in columns])
+                con.executemany(query, rows)
+            elapsed = time.perf_counter() - start
+            log.info(f"{n} rows are written to {self._path}:{table_name} "
+                     f"in {elapsed:.3f}s ({n / max(elapsed, 1e-9):,.0f} rows/s).")
+            return n
+
+        if self._writer is not None:
+            return self._writer.submit(write_rows)
+        with self.transaction() as con:
+            write_rows(con)
+
+    def _write_job(self, job: Callable[[sqlite3.Connection], Any]) -> Any:
+        """ Run `job` with the write connection and return its result once
+        committed: on the writer thread if the queue is enabled, otherwise
+        in a transaction on `con`.
+        """
+        if self._writer is not None:
+            return self._writer.submit(job).result()
+        with self.transaction() as con:
+            return job(con)
+
+    @contextmanager
+    def transaction(self):
+        """ Run the enclosed statements in one explicit transaction.
+        Commit on exit, rollback on error.
+        """
+        if not self.con.in_transaction:
+            self.execute("BEGIN")
+        try:
+            yield self.con
+        except Exception:
+            self.con.rollback()
+            raise
+        else:
+            self.con.commit()
 
     def create_table(self, *,
                      table_name: str,
                      columns: List[str],
-                     index=Union[str, List[str]]):
-        
+                     index=Union[str, List[str]],
+                     types: Optional[Dict[str, str]]=None):
+        """ Create a table. `types` maps columns to the logical types in
+        codec.py and is recorded in the schema table; without it every
+        column is TEXT (legacy layout) and no schema is recorded.
+        """
         if isinstance(index, str):
             index = [index]
         assert all([_ in columns for _ in index]), f"not all of {index} are found in {columns}"
         assert not self.table_exists(table_name), f"table {table_name} already exists"
-        query = f"""CREATE TABLE {table_name} ({",".join([f"{k} TEXT" for k in columns])},PRIMARY KEY ({",".join(index)}));"""
-        self.execute(query)
-        self.con.commit()
-        log.info(f"created table {table_name} at {self._path}; index = {index}")
+        if types is None:
+            sqlite_types = {k: "TEXT" for k in columns}
+        else:
+            sqlite_types = {k: _SQLITE_TYPES[types[k]] for k in columns}
+        query = f"""CREATE TABLE {table_name} ({",".join([f"{k} {sqlite_types[k]}" for k in columns])},PRIMARY KEY ({",".join(index)}));"""
+
+        def create(con: sqlite3.Connection):
+            con.execute(query)
+            if types is not None:
+                self._record_schema(con, table_name, {k: types[k] for k in columns})
+
+        self._write_job(create)
+        if types is not None:
+            self._schemas[table_name] = {k: types[k] for k in columns}
+        log.info(f"created table {table_name} at {self._path}; index = {index}; types = {sqlite_types}")
+        for columns in self._pending_indexes.pop(table_name, []):
+            self.create_index(table_name, columns)
+
+    def create_index(self,
+                     table_name: str,
+                     columns: Union[str, List[str]],
+                     *,
+                     unique: bool=False,
+                     name: Optional[str]=None):
+        """ Create a secondary index on `columns` if it doesn't exist.
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        if name is None:
+            name = f"idx_{table_name}_{'_'.join(columns)}"
+        query = f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table_name} ({', '.join(columns)})"
+        self._write_job(lambda con: con.execute(query))
+        log.info(f"ensured index {name} on {table_name}{columns}")
+
+    def ensure_indexes(self, table_name: str, indexes: List[Union[str, List[str]]]):
+        """ Create each of `indexes` on `table_name`; deferred until the
+        table is created if it doesn't exist yet.
+        """
+        if self.table_exists(table_name):
+            for columns in indexes:
+                self.create_index(table_name, columns)
+        else:
+            self._pending_indexes.setdefault(table_name, []).extend(indexes)
 
-    def read_sql(self, query: str, parse_str_columns=True) -> pd.DataFrame:
+    def explain(self, query: str, params: tuple=()) -> dict:
+        """ Return the query plan of `query` and whether it scans a whole
+        table or index ("SCAN", covering index included) instead of searching it.
+        Queued writes are flushed first and the plan is made on a new
+        connection, so it sees indexes created by the writer thread.
+        """
+        self.flush()
+        if self._path == ":memory:":
+            plan = [row[-1] for row in self.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+        else:
+            con = sqlite3.connect(self._path)
+            try:
+                plan = [row[-1] for row in con.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+            finally:
+                con.close()
+        uses_index = any([" USING " in _ and ("INDEX" in _ or "PRIMARY KEY" in _) for _ in plan])
+        full_scan = any([_.startswith("SCAN") for _ in plan])
+        log.info(f"query plan for {query}: {plan}")
+        return {
+            "plan": plan,
+            "uses_index": uses_index,
+            "full_scan": full_scan,
+        }
+
+    def _record_schema(self, con: sqlite3.Connection, table_name: str, types: Dict[str, str]):
+        con.execute(f"""CREATE TABLE IF NOT EXISTS {self._schema_table} (table_name TEXT, column_name TEXT, column_type TEXT, PRIMARY KEY (table_name, column_name));""")
+        con.executemany(f"REPLACE INTO {self._schema_table} (table_name, column_name, column_type) VALUES (?, ?, ?)",
+                        [(table_name, k, v) for k, v in types.items()])
+
+    def widen_columns(self, table_name: str, types: Dict[str, str]):
+        """ Change the recorded type of columns to `types`, see `widen_type`.
+        Stored values of "int" columns widened to "int256" are re-encoded.
+        """
+        schema = self.schema(table_name)
+
+        def widen(con: sqlite3.Connection):
+            for k, column_type in types.items():
+                if schema[k] == "int" and column_type == "int256":
+                    rows = con.execute(f"SELECT rowid, {k} FROM {table_name} WHERE typeof({k}) = 'integer'").fetchall()
+                    con.executemany(f"UPDATE {table_name} SET {k} = ? WHERE rowid = ?",
+                                    [(encode_int256(x), rowid) for rowid, x in rows])
+            self._record_schema(con, table_name, types)
+
+        self._write_job(widen)
+        self._schemas[table_name] = {**schema, **types}
+        log.info(f"widened columns of {table_name}: {types}")
+
+    def schema(self, table_name: str) -> Optional[Dict[str, str]]:
+        """ Return the recorded {column: type} of `table_name`, None for legacy tables.
+        """
+        if table_name not in self._schemas:
+            if not self.table_exists(self._schema_table):
+                return None
+            rows = self.execute(f"SELECT column_name, column_type FROM {self._schema_table} WHERE table_name = ?", (table_name,)).fetchall()
+            if not rows:
+                return None
+            self._schemas[table_name] = dict(rows)
+        return self._schemas[table_name]
+
+    def read_sql(self, query: str, parse_str_columns=True, table_name: Optional[str]=None) -> pd.DataFrame:
+        """ Columns of `table_name` are decoded with its recorded schema;
+        the rest are auto-parsed if `parse_str_columns` is True.
+        """
         log.info(f"querying dataframe from {query}")
-        df = pd.read_sql_query(query, self.con)
-        if parse_str_columns is True:
-            self.parse_str_columns(df, inplace=True)
+        with self.read_connection() as con:
+            df = pd.read_sql_query(query, con)
+        return self._decode_frame(df, table_name=table_name, parse_str_columns=parse_str_columns)
+
+    def _decode_frame(self, df: pd.DataFrame, *, table_name: Optional[str], parse_str_columns: bool) -> pd.DataFrame:
+        schema = self.schema(table_name) if table_name is not None else None
+        if schema is not None:
+            for v in df.columns:
+                if v in schema:
+                    df[v] = _decode_column(df[v], schema[v])
+        elif parse_str_columns is True:
+            column_types = self._str_column_types.setdefault(table_name, {}) if table_name is not None else None
+            self.parse_str_columns(df, inplace=True, column_types=column_types)
         return df
     
     def read_table(self, table_name: str, parse_str_columns=True) -> pd.DataFrame:
         query = f"SELECT * from {table_name}"
-        return self.read_sql(query, parse_str_columns=parse_str_columns)
+        return self.read_sql(query, parse_str_columns=parse_str_columns, table_name=table_name)
+
+    def iter_sql(self,
+                 query: str,
+                 params: tuple=(),
+                 *,
+                 chunk_size: int=100_000,
+                 parse_str_columns=True,
+                 table_name: Optional[str]=None,
+                 ) -> Iterator[pd.DataFrame]:
+        """ Yield the result of `query` as DataFrame chunks of at most `chunk_size` rows,
+        decoded like `read_sql`. Only one chunk is held in memory at a time.
+        With the read pool enabled, the stream reads from its own read-only
+        connection, so a slow or abandoned consumer doesn't hold one of the pool's.
+        """
+        log.info(f"streaming dataframe from {query}, args = {params}, chunk_size = {chunk_size}")
+        con = self._read_pool.open() if self._read_pool is not None else self.con
+        cursor = con.execute(query, params)
+        columns = [_[0] for _ in cursor.description]
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame.from_records(rows, columns=columns)
+                yield self._decode_frame(df, table_name=table_name, parse_str_columns=parse_str_columns)
+        finally:
+            cursor.close()
+            if con is not self.con:
+                con.close()
+
+    def iter_table(self,
+                   table_name: str,
+                   *,
+                   columns: Optional[List[str]]=None,
+                   block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                   block_number_col: str="blockNumber",
+                   chunk_size: int=100_000,
+                   parse_str_columns=True,
+                   ) -> Iterator[pd.DataFrame]:
+        """ Stream `table_name` in chunks.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to select, all if None.
+        block_range : (start, end), optional
+            Keep rows with start <= `block_number_col` < end; either end can be None.
+        """
+        query, params = self._select_query(table_name, columns=columns, block_range=block_range, block_number_col=block_number_col)
+        yield from self.iter_sql(query, params, chunk_size=chunk_size, parse_str_columns=parse_str_columns, table_name=table_name)
+
+    def _select_query(self,
+                      table_name: str,
+                      *,
+                      columns: Optional[List[str]]=None,
+                      where: Optional[Dict[str, Any]]=None,
+                      block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                      block_number_col: str="blockNumber",
+                      order_by: Optional[Union[str, List[str]]]=None,
+                      limit: Optional[int]=None,
+                      ) -> Tuple[str, tuple]:
+        query = f"SELECT {', '.join(columns) if columns else '*'} FROM {table_name}"
+        conditions, params = self._where_clause(table_name, where=where, block_range=block_range, block_number_col=block_number_col)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        order = parse_order_by(order_by)
+        if order:
+            query += " ORDER BY " + ", ".join([f"{self._numeric_col(table_name, k, block_number_col)} {'ASC' if asc else 'DESC'}" for k, asc in order])
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        return query, tuple(params)
+
+    def _numeric_col(self, table_name: str, col: str, block_number_col: str) -> str:
+        # legacy TEXT tables would compare block numbers as strings
+        if col == block_number_col and self.schema(table_name) is None:
+            return f"CAST({col} AS INTEGER)"
+        return col
+
+    def _where_clause(self,
+                      table_name: str,
+                      *,
+                      where: Optional[Dict[str, Any]]=None,
+                      block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+                      block_number_col: str="blockNumber",
+                      ) -> Tuple[List[str], list]:
+        conditions, params = [], []
+        schema = self.schema(table_name)
+        for k, v in (where or {}).items():
+            values = list(v) if is_multi_value(v) else [v]
+            if schema is None: # legacy all-TEXT table
+                encoded = [str(_) for _ in values]
+            else:
+                encoded = _encode_column(pd.Series(values, dtype=object), schema[k]).tolist()
+            if is_multi_value(v):
+                conditions.append(f"{k} IN ({', '.join(['?'] * len(encoded))})")
+                params.extend(encoded)
+            else:
+                conditions.append(f"{k} = ?")
+                params.append(encoded[0])
+        if block_range is not None:
+            col = self._numeric_col(table_name, block_number_col, block_number_col)
+            start, end = block_range
+            if start is not None:
+                conditions.append(f"{col} >= ?")
+                params.append(int(start))
+            if end is not None:
+                conditions.append(f"{col} < ?")
+                params.append(int(end))
+        return conditions, params
+
+    def query(self,
+              table_name: str,
+              *,
+              columns: Optional[List[str]]=None,
+              where: Optional[Dict[str, Any]]=None,
+              block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+              order_by: Optional[Union[str, List[str]]]=None,
+              limit: Optional[int]=None,
+              block_number_col: str="blockNumber",
+              ) -> pd.DataFrame:
+        """ See `DataBase.query`. Translated to one parameterized SELECT.
+        """
+        query, params = self._select_query(table_name, columns=columns, where=where, block_range=block_range,
+                                           block_number_col=block_number_col, order_by=order_by, limit=limit)
+        log.info(f"querying dataframe from {query}, args = {params}")
+        with self.read_connection() as con:
+            df = pd.read_sql_query(query, con, params=params)
+        return self._decode_frame(df, table_name=table_name, parse_str_columns=True)
+
+    def delete(self,
+               table_name: str,
+               *,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> int:
+        conditions, params = self._where_clause(table_name, where=where, block_range=block_range)
+        assert conditions, "refusing to delete without conditions"
+        query = f"DELETE FROM {table_name} WHERE {' AND '.join(conditions)}"
+        n = self._write_job(lambda con: con.execute(query, tuple(params)).rowcount)
+        log.info(f"deleted {n} rows from {table_name} where {where}, block_range = {block_range}")
+        return n
 
     def delete_table(self, table_name: str) -> bool:
         """ Return True if deleted is done.
@@ -73,7 +551,16 @@ class SQLiteDB:
         while True:
             cmd = input(f"delete {table_name}? (yes/no)")
             if cmd == "yes":
-                self.execute(f"DROP TABLE {table_name}")
+                drop_schema = self.table_exists(self._schema_table)
+
+                def drop(con: sqlite3.Connection):
+                    con.execute(f"DROP TABLE {table_name}")
+                    if drop_schema:
+                        con.execute(f"DELETE FROM {self._schema_table} WHERE table_name = ?", (table_name,))
+
+                self._write_job(drop)
+                self._schemas.pop(table_name, None)
+                self._str_column_types.pop(table_name, None)
                 return True
             elif cmd == "no":
                 return False
@@ -86,32 +573,91 @@ class SQLiteDB:
             log.error(f"{query} failed with error {e}")
             raise e
     
+    def executemany(self, query: str, rows):
+        try:
+            log.debug(f"executing many query = {query}")
+            return self.con.executemany(query, rows)
+        except Exception as e:
+            log.error(f"{query} failed with error {e}")
+            raise e
+
     def table_exists(self, table_name: str) -> bool:
         c = self.execute(f'''SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}' ''')
         return c.fetchone() is not None
 
     @staticmethod
-    def parse_str_columns(df: pd.DataFrame, inplace: bool=True) -> Optional[pd.DataFrame]:
+    def parse_str_columns(df: pd.DataFrame,
+                          inplace: bool=True,
+                          column_types: Optional[Dict[str, str]]=None,
+                          ) -> Optional[pd.DataFrame]:
         """ Auto-parse string columns.
 
+        "True"/"False" columns become bool, integer columns that fit in
+        int64 become int64 arrays, and wider integer columns (token amounts)
+        become object arrays of python ints -- the same representation as
+        decoded "int256" columns, see codec.py.
+
         Parameters
         ----------
         df : pd.DataFrame
         inplcace : bool
             If True, modify `df` in-place, return None. Otherwise,
             modify a copy of `df` and return the modified copy.
+        column_types : dict, optional
+            {column: type} detected so far, e.g. for one table. Known columns
+            skip detection; newly detected ones are added to it.
         """
         if inplace is not True:
             df = df.copy()
+        if column_types is None:
+            column_types = {}
         for v in df.columns:
-            if is_string_dtype(df[v]):
-                if np.all(df[v].isin(["True", "False"])):
-                    log.info(f"parsing boolean column {v}")
-                    df[v] = np.where(df[v] == "True", True, False)
-                elif np.all(df[v].str.isdigit()):
-                    log.info(f"parsing integer column {v}")
-                    df[v] = df[v].apply(lambda x: int(x))
-                else:
-                    pass
+            if not is_string_dtype(df[v]):
+                continue
+            column_type = column_types.get(v)
+            parsed = _parse_str_column(df[v], column_type) if column_type is not None else None
+            if parsed is None: # unknown, or the cached type no longer holds
+                column_type, parsed = _detect_str_column(df[v])
+                column_types[v] = column_type
+                if column_type != "str":
+                    log.info(f"parsing {column_type} column {v}")
+            if column_type != "str":
+                df[v] = parsed
         if inplace is not True:
-            return df
\ No newline at end of file
+            return df
+
+
+def _parse_str_column(s: pd.Series, column_type: str) -> Optional[pd.Series]:
+    """ Parse `s` as `column_type`; None if it doesn't parse.
+    """
+    try:
+        if column_type == "bool":
+            if not np.all(s.isin(["True", "False"])):
+                return None
+            return pd.Series(s.to_numpy(dtype=object) == "True", index=s.index)
+        elif column_type == "int":
+            return s.astype("int64")
+        elif column_type == "int256":
+            if not np.all(s.str.fullmatch(r"-?\d+")):
+                return None
+            return pd.Series([int(x) for x in s], index=s.index, dtype=object)
+        else:
+            return s
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def _detect_str_column(s: pd.Series) -> Tuple[str, pd.Series]:
+    """ Return (type, parsed) for a string column.
+    """
+    if np.all(s.isin(["True", "False"])):
+        return "bool", _parse_str_column(s, "bool")
+    try:
+        return "int", s.astype("int64") # vectorized; raises if not integers or too wide
+    except OverflowError:
+        parsed = _parse_str_column(s, "int256")
+        if parsed is not None:
+            return "int256", parsed
+    except (ValueError, TypeError):
+        pass
+    return "str", s
@@ -0,0 +1,187 @@
+"""
+Concurrency helpers for SQLiteDB: a pool of read-only connections and
+a single writer thread that serializes and batches writes.
+"""
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Callable, Any, Iterator, Optional
+
+from . import log
+
+
+__all__ = [
+    "SQLiteReadPool",
+    "SQLiteWriter",
+]
+
+
+class SQLiteReadPool:
+    """ A fixed-size pool of read-only connections (URI `mode=ro`).
+
+    Readers only see committed data and, with the WAL journal, don't
+    block behind the writer. `connection` waits at most `acquire_timeout`
+    seconds for an idle connection; long streams should use their own
+    connection from `open` instead of holding one of the pool's.
+    """
+
+    def __init__(self, path: str, size: int=4, acquire_timeout: Optional[float]=30., **kw):
+        self._path = path
+        self._size = size
+        self._acquire_timeout = acquire_timeout
+        self._kw = kw
+        self._pool = queue.Queue()
+        for _ in range(size):
+            self._pool.put(self.open())
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._wait_total = 0.
+        self._wait_max = 0.
+        log.info(f"opened {size} read-only connections to {path}")
+
+    def open(self) -> sqlite3.Connection:
+        """ A new read-only connection, not part of the pool.
+        """
+        return sqlite3.connect(f"file:{self._path}?mode=ro", uri=True, check_same_thread=False, **self._kw)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        start = time.perf_counter()
+        try:
+            con = self._pool.get(timeout=self._acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no read connection to {self._path} became idle in {self._acquire_timeout}s")
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._acquired += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        try:
+            yield con
+        finally:
+            self._pool.put(con)
+
+    def stats(self) -> dict:
+        """ Connection wait-time statistics, in seconds.
+        """
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": self._pool.qsize(),
+                "acquired": self._acquired,
+                "wait_total": self._wait_total,
+                "wait_mean": self._wait_total / max(self._acquired, 1),
+                "wait_max": self._wait_max,
+            }
+
+    def close(self):
+        for _ in range(self._size):
+            self._pool.get().close()
+        log.info(f"closed read-only connections to {self._path}")
+
+
+class SQLiteWriter:
+    """ A dedicated thread owning the write connection.
+
+    Jobs are callables taking the connection. The thread drains up to
+    `batch_size` queued jobs at a time and commits them in one transaction;
+    each job runs in its own savepoint so a failing job is rolled back
+    alone. `submit` returns a Future of the job's return value. If the
+    batch itself fails, e.g. the database is locked, its jobs fail with
+    that error and the thread goes on with the next batch.
+    """
+
+    _stop = object()
+
+    def __init__(self, path: str, batch_size: int=64, max_queue_size: int=1024, **kw):
+        self._path = path
+        self._batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue_size) # put() blocks when the writer falls behind
+        self._kw = kw
+        self._jobs = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer-{path}", daemon=True)
+        self._thread.start()
+
+    def submit(self, job: Callable[[sqlite3.Connection], Any]) -> Future:
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def flush(self):
+        """ Block until every job submitted so far is committed.
+        """
+        self.submit(lambda con: None).result()
+
+    def close(self):
+        self._queue.put(self._stop)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "jobs": self._jobs,
+            "batches": self._batches,
+        }
+
+    def _run(self):
+        con = sqlite3.connect(self._path, isolation_level=None, **self._kw) # transactions are managed explicitly
+        con.execute("PRAGMA journal_mode=WAL")
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(_ is self._stop for _ in batch)
+            batch = [_ for _ in batch if _ is not self._stop]
+            if batch:
+                try:
+                    self._commit_batch(con, batch)
+                except Exception as e:
+                    log.error(f"write batch of {len(batch)} jobs failed with error {e}")
+                    self._rollback(con)
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stop:
+                break
+        con.close()
+        log.info(f"writer to {self._path} stopped")
+
+    def _commit_batch(self, con: sqlite3.Connection, batch: list):
+        start = time.perf_counter()
+        results = []
+        con.execute("BEGIN")
+        for job, future in batch:
+            con.execute("SAVEPOINT job")
+            try:
+                results.append((future, job(con), None))
+                con.execute("RELEASE job")
+            except Exception as e:
+                log.error(f"write job failed with error {e}")
+                con.execute("ROLLBACK TO job")
+                con.execute("RELEASE job")
+                results.append((future, None, e))
+        con.execute("COMMIT")
+        for future, res, e in results:
+            if e is None:
+                future.set_result(res)
+            else:
+                future.set_exception(e)
+        self._jobs += len(batch)
+        self._batches += 1
+        log.debug(f"committed {len(batch)} write jobs in {time.perf_counter() - start:.3f}s")
+
+    @staticmethod
+    def _rollback(con: sqlite3.Connection):
+        if not con.in_transaction:
+            return
+        try:
+            con.execute("ROLLBACK")
+        except Exception as e:
+            log.error(f"rollback failed with error {e}")
@@ -0,0 +1,258 @@
+import threading
+import pandas as pd
+from typing import Union, List, Optional, Dict, Tuple, Any
+
+from . import DataBase, log, sort_and_limit, parse_order_by
+
+
+__all__ = [
+    "TieredDataBase",
+]
+
+
+class TieredDataBase(DataBase):
+    """ Recent blocks in a `hot` database, older ones in a `cold` one,
+    typically MongoDB / SQLiteDB in front of a ParquetDB.
+
+    Each table has a boundary block: rows below it live in `cold`, the rest
+    in `hot`. `migrate` moves everything older than the last `hot_blocks`
+    blocks to `cold` and advances the boundary, so the hot tables and their
+    indexes stay bounded. Reads are federated: a block range is split at the
+    boundary and each part read from its tier. Tables without a block number
+    column are kept in `hot` only.
+
+    Boundaries and table indexes are kept in `hot`, in `tiers_table`.
+    """
+
+    tiers_table = "tier_boundaries"
+
+    def __init__(self,
+                 hot: DataBase,
+                 cold: DataBase,
+                 *,
+                 hot_blocks: int=500_000,
+                 chunk_blocks: int=10_000,
+                 block_number_col: str="blockNumber",
+                 migrate_interval: Optional[float]=None):
+        """ If `migrate_interval` is given, run `migrate_all` in a background
+        thread every `migrate_interval` seconds until `stop`.
+        """
+        self._hot = hot
+        self._cold = cold
+        self._hot_blocks = hot_blocks
+        self._chunk_blocks = chunk_blocks
+        self._block_number_col = block_number_col
+        self._tiers = None # table_name -> {"boundary": int, "index": [str]}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        if migrate_interval is not None:
+            self.start(migrate_interval)
+
+    @property
+    def hot(self) -> DataBase:
+        return self._hot
+
+    @property
+    def cold(self) -> DataBase:
+        return self._cold
+
+    def __getattr__(self, name: str) -> Any:
+        # anything backend-specific, e.g. `con`, goes to the hot tier
+        return getattr(self._hot, name)
+
+    def init(self, *a, **kw):
+        self._hot.init(*a, **kw)
+
+    @property
+    def tiers(self) -> Dict[str, dict]:
+        with self._lock:
+            if self._tiers is None:
+                self._tiers = {}
+                if self._hot.table_exists(self.tiers_table):
+                    for row in self._hot.query(self.tiers_table).to_dict("records"):
+                        self._tiers[row["table_name"]] = {
+                            "boundary": int(row["boundary"]),
+                            "index": row["index_columns"].split(","),
+                        }
+            return self._tiers
+
+    def boundary(self, table_name: str) -> int:
+        """ The first block kept in the hot tier; 0 if nothing is migrated.
+        """
+        tier = self.tiers.get(table_name)
+        return tier["boundary"] if tier is not None else 0
+
+    def _set_tier(self, table_name: str, *, boundary: int, index: List[str]):
+        with self._lock:
+            self.tiers[table_name] = {"boundary": boundary, "index": index}
+            if self._hot.table_exists(self.tiers_table):
+                self._hot.delete(self.tiers_table, where={"table_name": table_name})
+            self._hot.write(
+                pd.DataFrame([{"table_name": table_name, "boundary": boundary, "index_columns": ",".join(index)}]),
+                table_name=self.tiers_table,
+                index="table_name")
+
+    def table_exists(self, table_name: str) -> bool:
+        return self._hot.table_exists(table_name) or self._cold.table_exists(table_name)
+
+    def ensure_indexes(self, table_name: str, indexes: List[Union[str, List[str]]]):
+        return self._hot.ensure_indexes(table_name, indexes)
+
+    def create_table(self, *, table_name: str, **kw):
+        return self._hot.create_table(table_name=table_name, **kw)
+
+    def write(self,
+              df: pd.DataFrame,
+              *,
+              table_name: str,
+              index: Union[str, List[str]],
+              types: Optional[Dict[str, str]]=None,
+              **kw):
+        """ Write rows below the boundary of `table_name` to the cold tier, the rest to the hot tier.
+        `types` declares column types to both tiers, see `infer_schema`.
+        """
+        if isinstance(index, str):
+            index = [index]
+        if self._block_number_col not in df:
+            return self._hot.write(df, table_name=table_name, index=index, types=types, **kw)
+        with self._lock: # the boundary can't move until the rows are in their tiers, see `migrate`
+            if table_name not in self.tiers:
+                self._set_tier(table_name, boundary=0, index=index)
+            is_cold = df[self._block_number_col].astype("int64") < self.boundary(table_name)
+            if is_cold.any():
+                log.info(f"{int(is_cold.sum())} rows of {table_name} are below block {self.boundary(table_name)}, writing to the cold tier")
+                self._cold.write(df[is_cold], table_name=table_name, index=index, types=types)
+            if not is_cold.all():
+                return self._hot.write(df[~is_cold], table_name=table_name, index=index, types=types, **kw)
+
+    def query(self,
+              table_name: str,
+              *,
+              columns: Optional[List[str]]=None,
+              where: Optional[Dict[str, Any]]=None,
+              block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+              order_by: Optional[Union[str, List[str]]]=None,
+              limit: Optional[int]=None,
+              ) -> pd.DataFrame:
+        """ See `DataBase.query`. `block_range` is split at the boundary and
+        only the tiers it overlaps are read; ordering and limit are applied
+        to the merged result.
+        """
+        boundary = self.boundary(table_name)
+        start, end = block_range if block_range is not None else (None, None)
+        read_columns = None if columns is None else list(dict.fromkeys(columns + [k for k, _ in parse_order_by(order_by)]))
+        kw = dict(columns=read_columns, where=where, order_by=order_by, limit=limit)
+
+        frames = []
+        if self._hot.table_exists(table_name) and (end is None or end > boundary):
+            hot_start = boundary if boundary > 0 and (start is None or start < boundary) else start
+            frames.append(self._hot.query(table_name, block_range=(hot_start, end) if hot_start is not None or end is not None else None, **kw))
+            # newest-first with a limit, e.g. the max block: the hot tier alone answers it
+            if limit is not None and len(frames[0]) >= limit and parse_order_by(order_by)[:1] == [(self._block_number_col, False)]:
+                return sort_and_limit(frames[0], columns=columns, order_by=order_by, limit=limit)
+        if self._cold.table_exists(table_name) and boundary > 0 and (start is None or start < boundary):
+            cold_end = boundary if end is None else min(end, boundary)
+            frames.append(self._cold.query(table_name, block_range=(start, cold_end), **kw))
+        frames = [_ for _ in frames if len(_) > 0]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return sort_and_limit(pd.concat(frames, ignore_index=True), columns=columns, order_by=order_by, limit=limit)
+
+    def read_table(self, table_name: str, **kw) -> pd.DataFrame:
+        """ Read both tiers, see `query`.
+        """
+        return self.query(table_name, **kw)
+
+    def delete(self,
+               table_name: str,
+               *,
+               where: Optional[Dict[str, Any]]=None,
+               block_range: Optional[Tuple[Optional[int], Optional[int]]]=None,
+               ) -> int:
+        n = 0
+        for d in (self._hot, self._cold):
+            if d.table_exists(table_name):
+                n += d.delete(table_name, where=where, block_range=block_range)
+        return n
+
+    def delete_table(self, table_name: str) -> bool:
+        done = all([d.delete_table(table_name) for d in (self._hot, self._cold) if d.table_exists(table_name)])
+        if done and table_name in self.tiers:
+            with self._lock:
+                self._tiers.pop(table_name)
+                self._hot.delete(self.tiers_table, where={"table_name": table_name})
+        return done
+
+    def migrate(self, table_name: str, index: Optional[Union[str, List[str]]]=None) -> int:
+        """ Move rows older than the last `hot_blocks` blocks of `table_name`
+        to the cold tier, `chunk_blocks` at a time; return the rows moved.
+        `index` is needed for tables not yet written through this wrapper.
+
+        Each chunk is written to `cold`, then the boundary is advanced, then
+        the chunk is deleted from `hot`, so a concurrent read sees every row
+        in exactly one of the tiers it reads. Reading the chunk and advancing
+        the boundary hold the lock `write` takes, so a concurrent write lands
+        either in the chunk read or, once the boundary moved, in `cold`;
+        `write` blocks for that time.
+        """
+        if table_name not in self.tiers:
+            if index is None:
+                raise ValueError(f"index of {table_name} is unknown, pass `index`")
+            self._set_tier(table_name, boundary=0, index=[index] if isinstance(index, str) else list(index))
+        tier = self.tiers[table_name]
+        col = self._block_number_col
+        last = self._hot.query(table_name, columns=[col], order_by=f"-{col}", limit=1)
+        if len(last) == 0:
+            return 0
+        new_boundary = int(last.iloc[0, 0]) - self._hot_blocks + 1
+        if new_boundary <= tier["boundary"]:
+            return 0
+        if tier["boundary"] == 0:
+            first = self._hot.query(table_name, columns=[col], order_by=col, limit=1)
+            start = int(first.iloc[0, 0])
+        else:
+            start = tier["boundary"]
+        log.info(f"migrating {table_name} blocks [{start}, {new_boundary}) to the cold tier")
+        n = 0
+        for s in range(start, new_boundary, self._chunk_blocks):
+            e = min(s + self._chunk_blocks, new_boundary)
+            with self._lock:
+                if hasattr(self._hot, "flush"): # e.g. SQLiteDB writer queue
+                    self._hot.flush()
+                df = self._hot.query(table_name, block_range=(s, e))
+                if len(df) > 0:
+                    self._cold.write(df, table_name=table_name, index=tier["index"])
+                self._set_tier(table_name, boundary=e, index=tier["index"])
+            if len(df) > 0:
+                self._hot.delete(table_name, block_range=(s, e))
+            n += len(df)
+        if n > 0 and hasattr(self._cold, "compact"): # e.g. merge ParquetDB part files
+            self._cold.compact(table_name)
+        log.info(f"migrated {n} rows of {table_name}; boundary = {new_boundary}")
+        return n
+
+    def migrate_all(self) -> Dict[str, int]:
+        res = {}
+        for table_name in list(self.tiers):
+            try:
+                res[table_name] = self.migrate(table_name)
+            except Exception as e:
+                log.error(f"failed to migrate {table_name} with error {e}")
+        return res
+
+    def start(self, interval: float=600.):
+        """ Run `migrate_all` every `interval` seconds in a background thread.
+        """
+        def _run():
+            while not self._stop.wait(interval):
+                self.migrate_all()
+        self._stop.clear()
+        self._thread = threading.Thread(target=_run, name="tier-migration", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
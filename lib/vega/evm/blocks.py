@@ -0,0 +1,159 @@
+"""
+A local index of block number <-> header timestamp.
+"""
+import os
+import json
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Union, List, Callable
+
+from . import log
+from ..utils import IntervalSet
+
+
+__all__ = [
+    "BlockTimestampIndex",
+]
+
+
+class BlockTimestampIndex:
+    """ Block numbers and their header timestamps (s since epoch) as two
+    sorted int64 arrays, memory-mapped when loaded:
+
+        <path>/blocks.npy
+        <path>/timestamps.npy
+        <path>/meta.json        block ranges covered
+
+    Timestamps strictly increase with block number, so lookups in both
+    directions are binary searches. Lookups outside the covered ranges
+    raise KeyError; callers fall back to the network. Both arrays are
+    held in one (blocks, timestamps) tuple, swapped whole by `add`, so a
+    concurrent lookup reads a consistent pair without taking the lock.
+    """
+
+    _meta_file = "meta.json"
+
+    def __init__(self, path: Union[str, Path], mmap: bool=True):
+        self._path = Path(path)
+        self._mmap_mode = "r" if mmap else None
+        self._lock = threading.Lock()
+        self._arrays = (np.array([], dtype=np.int64), np.array([], dtype=np.int64)) # (blocks, timestamps)
+        self._covered = IntervalSet()
+        if (self._path / self._meta_file).exists():
+            self._load()
+
+    def _load(self):
+        with open(self._path / self._meta_file, "r") as f:
+            meta = json.load(f)
+        self._covered = IntervalSet(meta["covered"])
+        if meta["size"] > 0:
+            self._arrays = (
+                np.load(self._path / "blocks.npy", mmap_mode=self._mmap_mode),
+                np.load(self._path / "timestamps.npy", mmap_mode=self._mmap_mode),
+            )
+        log.info(f"loaded {len(self)} block timestamps from {self._path}, covered = {self._covered}")
+
+    def _dump(self):
+        self._path.mkdir(parents=True, exist_ok=True)
+        for name, values in zip(["blocks", "timestamps"], self._arrays):
+            tmp = self._path / f"{name}.tmp.npy"
+            np.save(tmp, values)
+            os.replace(tmp, self._path / f"{name}.npy")
+        tmp = self._path / f"{self._meta_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"size": len(self), "covered": list(self._covered)}, f, indent=4)
+        os.replace(tmp, self._path / self._meta_file)
+
+    def __len__(self) -> int:
+        return len(self._arrays[0])
+
+    @property
+    def covered(self) -> IntervalSet:
+        return self._covered
+
+    def covers(self, sblock: int, eblock: int) -> bool:
+        return self._covered.covers(int(sblock), int(eblock))
+
+    def add(self, blocks: np.ndarray, timestamps: np.ndarray, save: bool=True):
+        """ Merge (block, timestamp) pairs into the index and, if `save`, save it.
+        """
+        blocks = np.asarray(blocks, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if len(blocks) == 0:
+            return
+        with self._lock:
+            old_blocks, old_timestamps = self._arrays
+            all_blocks = np.concatenate([old_blocks, blocks])
+            all_timestamps = np.concatenate([old_timestamps, timestamps])
+            all_blocks, first = np.unique(all_blocks, return_index=True)
+            self._arrays = (all_blocks, all_timestamps[first])
+            # each contiguous run of the new blocks is a covered range
+            blocks = np.unique(blocks)
+            breaks = np.flatnonzero(np.diff(blocks) != 1)
+            for s, e in zip(np.r_[0, breaks + 1], np.r_[breaks, len(blocks) - 1]):
+                self._covered.add(int(blocks[s]), int(blocks[e]))
+            if save:
+                self._dump()
+
+    def save(self):
+        with self._lock:
+            self._dump()
+
+    def update(self,
+               fetch: Callable[[List[int]], List[int]],
+               sblock: int,
+               eblock: int,
+               chunk_size: int=1000,
+               save_every: int=100) -> int:
+        """ Fill the missing blocks of [sblock, eblock], `chunk_size` at a
+        time; `fetch` maps block numbers to their header timestamps.
+        Fetched chunks are merged and saved every `save_every` chunks and
+        at the end, rather than rewriting the index for each chunk.
+        Return the number of blocks added.
+        """
+        n = 0
+        pending = []
+        def flush():
+            if pending:
+                self.add(np.concatenate([b for b, _ in pending]), np.concatenate([t for _, t in pending]))
+                pending.clear()
+        try:
+            for s, e in self._covered.missing(int(sblock), int(eblock)):
+                for cs in range(s, e + 1, chunk_size):
+                    blocks = np.arange(cs, min(cs + chunk_size, e + 1), dtype=np.int64)
+                    pending.append((blocks, np.asarray(fetch(blocks.tolist()), dtype=np.int64)))
+                    n += len(blocks)
+                    log.info(f"fetched blocks [{blocks[0]}, {blocks[-1]}], {n} blocks added")
+                    if len(pending) >= save_every:
+                        flush()
+        finally: # keep what was fetched if a fetch fails
+            flush()
+        return n
+
+    def timestamps(self, blocks: Union[int, np.ndarray]) -> np.ndarray:
+        """ Header timestamps of `blocks`, in seconds.
+        """
+        blocks = np.asarray(blocks, dtype=np.int64)
+        all_blocks, all_timestamps = self._arrays # one snapshot, see the class docstring
+        i = np.searchsorted(all_blocks, blocks)
+        found = (i < len(all_blocks)) & (all_blocks[np.minimum(i, len(all_blocks) - 1)] == blocks) if len(all_blocks) else np.zeros(blocks.shape, dtype=bool)
+        if not np.all(found):
+            raise KeyError(f"blocks {blocks[~found][:5]} are not indexed")
+        return np.asarray(all_timestamps[i])
+
+    def block_numbers(self, timestamps: Union[int, np.ndarray]) -> np.ndarray:
+        """ The last block at or before each timestamp (s), like Etherscan's
+        `getblocknobytime` with closest = "before".
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        all_blocks, all_timestamps = self._arrays # one snapshot, see the class docstring
+        i = np.searchsorted(all_timestamps, timestamps, side="right") - 1
+        # exact only if the next block is indexed too, i.e. nothing lies in between
+        j = np.clip(i, 0, max(len(all_blocks) - 2, 0))
+        found = (i >= 0) & (i + 1 < len(all_blocks))
+        if len(all_blocks) > 1:
+            found &= all_blocks[j + 1] == all_blocks[j] + 1
+        if not np.all(found):
+            raise KeyError(f"timestamps {timestamps[~found][:5]} are not indexed")
+        return np.asarray(all_blocks[i])
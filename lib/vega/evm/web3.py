@@ -1,6 +1,8 @@
 import os
+import time
 import typing
 import json
+import requests
 from web3 import Web3
 from web3.contract.contract import ContractEvent, Contract # for typing
 from functools import lru_cache
@@ -11,6 +13,7 @@ from ..utils import Singleton
 from . import log
 from .etherscan import *
 from .utils import *
+from .blocks import BlockTimestampIndex
 
 
 
@@ -30,6 +33,8 @@ class Web3Portal(Etherscanner, metaclass=Singleton):
             base_url = "https://mainnet.infura.io/v3"
             api_key = os.environ["INFURA_API_KEY"]
             url = f"{base_url}/{api_key}"
+            self._url = url
+            self._session = requests.Session()
             self._web3 = Web3(Web3.HTTPProvider(url))
             log.info(f"connecting to: {url}")
             assert self._web3.is_connected()
@@ -38,6 +43,141 @@ class Web3Portal(Etherscanner, metaclass=Singleton):
     def web3(self):
         return self._web3
 
+    @property
+    def block_index(self) -> BlockTimestampIndex:
+        """ The local block timestamp index, at $VEGA_BLOCK_INDEX or ~/vega/data/block_index.
+        """
+        if not hasattr(self, "_block_index"):
+            path = os.getenv("VEGA_BLOCK_INDEX", os.path.expandvars("$HOME/vega/data/block_index"))
+            self._block_index = BlockTimestampIndex(path)
+        return self._block_index
+
+    def batch_request(self,
+                      calls: typing.List[typing.Tuple[str, list]],
+                      max_batch_size: int=100,
+                      return_exceptions: bool=False,
+                      timeout: float=60.,
+                      max_retries: int=5,
+                      ) -> typing.List[typing.Any]:
+        """ Send JSON-RPC `calls`, (method, params) pairs, as batch requests of
+        up to `max_batch_size` calls and return the results in order.
+
+        A rate limited batch is retried after the provider's Retry-After, or
+        an exponential backoff, up to `max_retries` times; a batch rejected
+        as too large is split in half. A failed call, including one missing
+        from the response, raises ValueError, or is returned in its place if
+        `return_exceptions` is True.
+        """
+        res = []
+        for i in range(0, len(calls), max_batch_size):
+            res += self._send_batch(calls[i:i + max_batch_size], return_exceptions=return_exceptions, timeout=timeout, max_retries=max_retries)
+        return res
+
+    def _send_batch(self,
+                    calls: typing.List[typing.Tuple[str, list]],
+                    *,
+                    return_exceptions: bool,
+                    timeout: float,
+                    max_retries: int) -> typing.List[typing.Any]:
+        payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+        for retry in range(max_retries + 1):
+            response = self._session.post(self._url, json=payload, timeout=timeout)
+            try:
+                content = response.json()
+            except ValueError:
+                content = None
+            errors = [_.get("error") for _ in content if isinstance(_, dict)] if isinstance(content, list) \
+                else [content.get("error")] if isinstance(content, dict) else []
+            if not (response.status_code == 429 or any([_is_rate_limit_error(_) for _ in errors])):
+                break
+            if retry == max_retries:
+                raise ValueError(f"batch of {len(calls)} calls is still rate limited after {max_retries} retries: {response.text[:200]}")
+            wait = _retry_after(response, default=2 ** retry)
+            log.info(f"batch of {len(calls)} calls is rate limited ({response.status_code}); retrying in {wait}s")
+            time.sleep(wait)
+        if response.status_code == 413 or any([_is_size_error(_) for _ in errors]):
+            if len(calls) == 1: # e.g. too many logs, the caller has to narrow the call
+                e = ValueError(f"{calls[0][0]}{calls[0][1]} failed: {response.status_code} {response.text[:200]}")
+                if not return_exceptions:
+                    raise e
+                return [e]
+            half = len(calls) // 2
+            log.info(f"batch of {len(calls)} calls is too large ({response.status_code}); splitting into {half} + {len(calls) - half}")
+            kw = dict(return_exceptions=return_exceptions, timeout=timeout, max_retries=max_retries)
+            return self._send_batch(calls[:half], **kw) + self._send_batch(calls[half:], **kw)
+        if not isinstance(content, list):
+            raise ValueError(f"batch of {len(calls)} calls failed: {response.status_code} {response.text[:200]}")
+        by_id = {_.get("id"): _ for _ in content if isinstance(_, dict)}
+        res = []
+        for i, (method, params) in enumerate(calls):
+            if i not in by_id:
+                e = ValueError(f"{method}{params} failed: no response")
+                if not return_exceptions:
+                    raise e
+                res.append(e)
+            elif "error" in by_id[i]:
+                e = ValueError(f"{method}{params} failed: {by_id[i]['error']}")
+                if not return_exceptions:
+                    raise e
+                res.append(e)
+            else:
+                res.append(by_id[i]["result"])
+        return res
+
+    def get_blocks(self, block_numbers: typing.List[int], full_transactions: bool=False, **kw) -> typing.List[dict]:
+        """ Raw block headers (hex fields) of `block_numbers`, in one batch per `max_batch_size`.
+        """
+        return self.batch_request([("eth_getBlockByNumber", [hex(int(bn)), full_transactions]) for bn in block_numbers], **kw)
+
+    def get_block_timestamps(self, block_numbers: typing.List[int], **kw) -> typing.List[int]:
+        """ Header timestamps (s) of `block_numbers`, from the node. The block
+        index isn't read or filled here; `update_block_index` fills it,
+        saving in batches, with this as its fetch function.
+        """
+        return [int(_["timestamp"], 16) for _ in self.get_blocks(block_numbers, **kw)]
+
+    def get_balances(self,
+                     addrs: typing.List[str],
+                     block_numbers: typing.Optional[typing.List[int]]=None,
+                     **kw) -> typing.List[int]:
+        """ Wei balances of `addrs` at `block_numbers` (latest if None).
+        """
+        blocks = ["latest"] * len(addrs) if block_numbers is None else [hex(int(_)) for _ in block_numbers]
+        return [int(_, 16) for _ in self.batch_request([("eth_getBalance", [a, b]) for a, b in zip(addrs, blocks)], **kw)]
+
+    def call_functions(self,
+                       functions: list,
+                       block_identifier: typing.Union[int, str]="latest",
+                       **kw) -> typing.List[typing.Any]:
+        """ `eth_call` contract functions, e.g. `c.functions["name"]()`, in
+        one batch and ABI-decode the results. Single outputs are unwrapped.
+        """
+        block = block_identifier if isinstance(block_identifier, str) else hex(block_identifier)
+        calls = [("eth_call", [{"to": fn.address, "data": fn._encode_transaction_data()}, block]) for fn in functions]
+        res = []
+        for fn, raw in zip(functions, self.batch_request(calls, **kw)):
+            if isinstance(raw, Exception):
+                res.append(raw)
+                continue
+            output_types = [_["type"] for _ in fn.abi["outputs"]]
+            try:
+                values = self.web3.codec.decode(output_types, bytes.fromhex(raw[2:]))
+            except Exception as e:
+                if not kw.get("return_exceptions", False):
+                    raise
+                res.append(e)
+                continue
+            values = [csaddr(v) if t == "address" else v for t, v in zip(output_types, values)]
+            res.append(values[0] if len(values) == 1 else tuple(values))
+        return res
+
+    def update_block_index(self, sblock: int, eblock: typing.Optional[int]=None, chunk_size: int=1000) -> int:
+        """ Index the headers of [sblock, eblock] not indexed yet; `eblock` defaults to the latest block.
+        """
+        if eblock is None:
+            eblock = self.web3.eth.block_number
+        return self.block_index.update(self.get_block_timestamps, sblock, eblock, chunk_size=chunk_size)
+
     def get_logs(self, *,
                  sblock: typing.Optional[int]=None,
                  eblock: typing.Optional[int]=None,
@@ -88,7 +228,10 @@ class Web3Portal(Etherscanner, metaclass=Singleton):
     @lru_cache(maxsize=None)
     def get_block_number_by_timestamp(self, ts: pd.Timestamp) -> int:
         if isinstance(ts, pd.Timestamp):
-            return self.scan.get_block_number_by_timestamp(to_int(ts, "s"))
+            try:
+                return int(self.block_index.block_numbers(to_int(ts, "s")))
+            except KeyError:
+                return self.scan.get_block_number_by_timestamp(to_int(ts, "s"))
         else:
             raise TypeError(f"unsupported input type {ts} type = {type(ts)}")
 
@@ -104,18 +247,29 @@ class Web3Portal(Etherscanner, metaclass=Singleton):
             return abi
 
     def get_timestamp_from_block_number(self, block_number: typing.Union[pd.Series, int]) -> typing.Union[pd.Series, int]:
+        """ Exact timestamps from the block index if it has every block,
+        otherwise from the node, interpolated between the min and max block.
+        """
 
         def block_number_to_ts(bn: int) -> pd.Timestamp:
             return pd.to_datetime(self.web3.eth.get_block(bn).timestamp * 1e9, utc=True)
 
+        try:
+            ts = self.block_index.timestamps(block_number)
+            if isinstance(block_number, int):
+                return pd.to_datetime(int(ts), unit="s", utc=True)
+            ts = pd.to_datetime(ts, unit="s", utc=True)
+            return pd.Series(ts, index=block_number.index) if isinstance(block_number, pd.Series) else ts
+        except KeyError:
+            pass
+
         if isinstance(block_number, int):
             return block_number_to_ts(block_number)
         else:
             block_number = np.array(block_number)
             min_block = int(block_number.min())
             max_block = int(block_number.max())
-            stime = block_number_to_ts(min_block)
-            etime = block_number_to_ts(max_block)
+            stime, etime = pd.to_datetime(self.get_block_timestamps([min_block, max_block]), unit="s", utc=True)
             if min_block == max_block:
                 return stime
             else:
@@ -153,26 +307,59 @@ class ERC20TokenTracker(Web3Portal):
         )[0]
         return self.web3.eth.get_transaction(log_["txHash"])
 
-    def gather_token_info(self, addr: str) -> dict:
+    def get_creation_txs(self, addrs: typing.List[str]) -> typing.List[dict]:
+        """ Creation transactions of up to 5 contracts: one Etherscan request
+        and one JSON-RPC batch. Block numbers are ints, addresses checksummed.
+        """
+        logs = self.scan.get(
+            module="contract",
+            action="getcontractcreation",
+            contractaddresses=",".join(addrs),
+        )
+        tx_hashes = {_["contractAddress"].lower(): _["txHash"] for _ in logs}
+        txs = self.batch_request([("eth_getTransactionByHash", [tx_hashes[_.lower()]]) for _ in addrs])
+        for tx in txs:
+            tx["blockNumber"] = int(tx["blockNumber"], 16)
+            tx["from"] = csaddr(tx["from"])
+        return txs
 
+    def gather_token_info(self, addr: str) -> dict:
+        """ ERC20 properties, creation and WETH pool of `addr`. Node calls are
+        sent as JSON-RPC batches: the properties together with the pool
+        lookup, then the creation transactions and their blocks.
+        """
         addr = csaddr(addr)
         c = self.get_contract(addr=addr, type="erc20")
         token_info = {
             "addr": addr,
         }
-        for property_name in ["name", "symbol", "totalSupply", "decimals"]:
-            try:
-                value = c.functions[property_name]().call()
-                token_info[property_name] = value
-            except Exception as e:
-                log.error(f"failed to get {property_name} for {addr}, {e}")
-                token_info[property_name] = ""
-
+        property_names = ["name", "symbol", "totalSupply", "decimals"]
+        functions = [c.functions[_]() for _ in property_names]
+        try:
+            functions.append(self.get_uniswap_v2_factory().functions["getPair"](const("addr")["WETH"], addr))
+        except Exception as e:
+            log.info(f"failed to find WETH Pool V2: {e}")
+        values = self.call_functions(functions, return_exceptions=True)
+        for property_name, value in zip(property_names, values):
+            if isinstance(value, Exception):
+                log.error(f"failed to get {property_name} for {addr}, {value}")
+                value = ""
+            token_info[property_name] = value
+        pool_addr = values[-1] if len(values) > len(property_names) else None
+        has_pool = isinstance(pool_addr, str) and int(pool_addr, 16) != 0
 
-        creation_tx = self.get_creation_tx(addr)
-        creation_blkno = creation_tx["blockNumber"]
-        token_info["creationBlockNumber"] = creation_blkno
-        token_info["creationTime"] = self.get_timestamp_from_block_number(block_number=creation_blkno)
+        try:
+            creation_txs = self.get_creation_txs([addr, pool_addr] if has_pool else [addr])
+        except Exception as e:
+            if not has_pool:
+                raise
+            log.info(f"failed to find WETH Pool V2 creation: {e}")
+            creation_txs = self.get_creation_txs([addr])
+            has_pool = False
+        creation_times = pd.to_datetime(self.get_block_timestamps([_["blockNumber"] for _ in creation_txs]), unit="s", utc=True)
+        creation_tx = creation_txs[0]
+        token_info["creationBlockNumber"] = creation_tx["blockNumber"]
+        token_info["creationTime"] = creation_times[0]
         token_info["deployer"] = creation_tx["from"]
 
         optional_fields = [
@@ -183,13 +370,15 @@ class ERC20TokenTracker(Web3Portal):
         ]
         for f_ in optional_fields:
             token_info[f_] = ""
+        if not has_pool:
+            log.info(f"failed to find WETH Pool V2: {pool_addr}")
+            return token_info
         try:
-            pool_contract = self.get_uniswap_v2_pair(addr)
+            pool_contract = self.get_contract(addr=pool_addr)
             token_info["WETHPoolV2"] = pool_contract.address
-            pool_creation_tx = self.get_creation_tx(token_info["WETHPoolV2"])
-            token_info["WETHPoolV2CreationTime"] = self.get_timestamp_from_block_number(block_number=int(pool_creation_tx["blockNumber"]))
-            token_info["WETHPoolV2Token0"] = pool_contract.functions["token0"]().call()
-            token_info["WETHPoolV2Token1"] = pool_contract.functions["token1"]().call()
+            token_info["WETHPoolV2CreationTime"] = creation_times[1]
+            token_info["WETHPoolV2Token0"], token_info["WETHPoolV2Token1"] = self.call_functions(
+                [pool_contract.functions["token0"](), pool_contract.functions["token1"]()])
         except Exception as e:
             log.info(f"failed to find WETH Pool V2: {e}")
 
@@ -203,4 +392,34 @@ class ERC20TokenTracker(Web3Portal):
         return c.functions["decimals"]().call()
 
     def get_transfer_logs(self):
-        pass
\ No newline at end of file
+        pass
+
+
+def _is_rate_limit_error(error: typing.Optional[dict]) -> bool:
+    """ Whether a JSON-RPC error means the requests were too fast, rather
+    than that the call itself failed. Providers also send -32005 for too
+    many results, which is a size error.
+    """
+    if not isinstance(error, dict) or _is_size_error(error):
+        return False
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == -32005 or any([_ in message for _ in ["too many requests", "rate limit", "rate exceeded", "limit exceeded"]])
+
+
+def _is_size_error(error: typing.Optional[dict]) -> bool:
+    """ Whether a JSON-RPC error means the batch or a call's result was
+    too big, e.g. "query returned more than 10000 results".
+    """
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get("message", "")).lower()
+    return any([_ in message for _ in ["batch", "too large", "payload", "more than", "response size", "block range"]])
+
+
+def _retry_after(response: requests.Response, default: float) -> float:
+    """ Seconds to wait from the Retry-After header (in seconds), else `default`.
+    """
+    try:
+        return max(float(response.headers.get("Retry-After")), 0.)
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,170 @@
+"""
+Append-only segment store for incremental script outputs.
+"""
+import os
+import time
+import json
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Union, Optional, List
+
+from . import log
+
+
+__all__ = [
+    "SegmentStore",
+]
+
+
+class SegmentStore:
+    """ A directory of CSV segments plus a small manifest:
+
+        <path>/manifest.json
+        <path>/seg-000000.csv
+        <path>/seg-000001.csv
+        ...
+
+    Each run appends only its new rows as a segment; the manifest keeps
+    the max block number / timestamp seen so warm starts don't have to read
+    the data. `compact` merges the segments into one; the merged files are
+    kept for `grace` seconds, so readers still holding the old manifest
+    can finish, and removed by a later `append` or `compact`.
+    """
+
+    _manifest_file = "manifest.json"
+
+    def __init__(self, path: Union[str, Path], grace: float=600.):
+        self._path = Path(path)
+        self._grace = grace
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def manifest(self) -> dict:
+        f_ = self._path / self._manifest_file
+        if not f_.exists():
+            return {"next_id": 0, "segments": [], "retired": [], "max_block": None, "max_timestamp": None}
+        with open(f_, "r") as f:
+            return json.load(f)
+
+    def _dump_manifest(self, manifest: dict):
+        f_ = self._path / self._manifest_file
+        tmp = f_.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp, f_)
+
+    def exists(self) -> bool:
+        return (self._path / self._manifest_file).exists()
+
+    @property
+    def max_block(self) -> Optional[int]:
+        return self.manifest["max_block"]
+
+    @property
+    def max_timestamp(self) -> Optional[pd.Timestamp]:
+        ts = self.manifest["max_timestamp"]
+        return pd.to_datetime(ts) if ts is not None else None
+
+    def append(self,
+               df: pd.DataFrame,
+               *,
+               block_number_col: str="blockNumber",
+               time_col: str="timestamp",
+               ) -> Optional[Path]:
+        """ Write `df` as a new segment and update the manifest.
+        """
+        if len(df) == 0:
+            return None
+        self._path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            manifest = self.manifest
+            f_ = self._path / f"seg-{manifest['next_id']:06d}.csv"
+            df.to_csv(f_, index=False)
+            segment = {"file": f_.name, "rows": len(df), "max_block": None, "max_timestamp": None}
+            if block_number_col in df:
+                segment["max_block"] = int(df[block_number_col].max())
+            if time_col in df:
+                segment["max_timestamp"] = str(pd.to_datetime(df[time_col]).max())
+            manifest["next_id"] += 1
+            manifest["segments"].append(segment)
+            manifest["max_block"] = _max(manifest["max_block"], segment["max_block"])
+            manifest["max_timestamp"] = _max(manifest["max_timestamp"], segment["max_timestamp"], key=pd.to_datetime)
+            self._purge_retired(manifest)
+            self._dump_manifest(manifest)
+        log.info(f"{len(df)} rows are appended to {f_}")
+        return f_
+
+    def read(self) -> pd.DataFrame:
+        segments = self.manifest["segments"]
+        if not segments:
+            return pd.DataFrame()
+        try:
+            return pd.concat([pd.read_csv(self._path / _["file"]) for _ in segments], ignore_index=True)
+        except FileNotFoundError: # compacted longer than `grace` ago; the new manifest lists the merged segment
+            return pd.concat([pd.read_csv(self._path / _["file"]) for _ in self.manifest["segments"]], ignore_index=True)
+
+    def compact(self, background: bool=False) -> Optional[threading.Thread]:
+        """ Merge all current segments into one. Segments appended while
+        compacting are kept as they are.
+        """
+        if background:
+            t = threading.Thread(target=self.compact, name=f"compact-{self._path}")
+            t.start()
+            return t
+        segments = self.manifest["segments"]
+        if len(segments) <= 1:
+            return None
+        df = pd.concat([pd.read_csv(self._path / _["file"]) for _ in segments], ignore_index=True)
+        with self._lock:
+            manifest = self.manifest
+            f_ = self._path / f"seg-{manifest['next_id']:06d}.csv"
+            df.to_csv(f_, index=False)
+            merged = {
+                "file": f_.name,
+                "rows": len(df),
+                "max_block": _max(*[_["max_block"] for _ in segments]),
+                "max_timestamp": _max(*[_["max_timestamp"] for _ in segments], key=pd.to_datetime),
+            }
+            compacted = {_["file"] for _ in segments}
+            manifest["next_id"] += 1
+            manifest["segments"] = [merged] + [_ for _ in manifest["segments"] if _["file"] not in compacted]
+            self._purge_retired(manifest)
+            manifest["retired"] = manifest.get("retired", []) + [{"file": _, "time": time.time()} for _ in sorted(compacted)]
+            self._dump_manifest(manifest)
+        log.info(f"compacted {len(segments)} segments ({len(df)} rows) into {f_}")
+
+    def _purge_retired(self, manifest: dict):
+        """ Remove segment files retired by `compact` more than `grace` seconds ago.
+        """
+        now = time.time()
+        retired = manifest.get("retired", [])
+        for _ in retired:
+            if now - _["time"] >= self._grace:
+                (self._path / _["file"]).unlink(missing_ok=True)
+        manifest["retired"] = [_ for _ in retired if now - _["time"] < self._grace]
+
+    def maybe_compact(self, max_segments: int=16, background: bool=True) -> Optional[threading.Thread]:
+        """ Compact if there are more than `max_segments` segments.
+        """
+        if len(self.manifest["segments"]) > max_segments:
+            return self.compact(background=background)
+
+    def clear(self):
+        """ Remove all segments and the manifest.
+        """
+        with self._lock:
+            manifest = self.manifest
+            for _ in manifest["segments"] + manifest.get("retired", []):
+                (self._path / _["file"]).unlink(missing_ok=True)
+            (self._path / self._manifest_file).unlink(missing_ok=True)
+        log.info(f"cleared {self._path}")
+
+
+def _max(*values, key=lambda x: x):
+    values = [_ for _ in values if _ is not None]
+    return max(values, key=key) if values else None
@@ -1,7 +1,11 @@
 """
 Functions that are hard to name a category.
 """
-from typing import Callable, Any, List
+import time
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, List, Tuple, Iterable, Iterator, Optional
 from . import log
 
 
@@ -11,32 +15,271 @@ def apply_range(*,
     end: Any,
     max_batch_size: Any,
     min_batch_size: Any=None,
+    concurrency: int=1,
+    on_result: Optional[Callable[[Any], Any]]=None,
+    controller: Optional["BatchSizeController"]=None,
+    count: Optional[Callable[[Any], int]]=None,
     ) -> List[Any]:
     """
     Apply `func` to sub-intervals of size `max_batch_size` of [start, end].
-    Retrying with half batch_size if failed.
+    Retrying with half batch_size if failed; integer batch sizes stay integers.
+
+    If `concurrency` > 1, the sub-intervals are run on that many threads,
+    each keeping its own retries. `on_result` is called with each result
+    in range order, in the calling thread, and its return value is kept
+    in place of the result.
+
+    If a `controller` is given, it picks each batch size instead, see
+    `BatchSizeController`; `count(result)` gives the number of items in a
+    result for its density estimate. Not supported with `concurrency` > 1.
     """
+    if controller is not None:
+        if concurrency > 1:
+            raise ValueError("an adaptive controller needs sequential batches, concurrency must be 1")
+        if on_result is None:
+            on_result = lambda x: x
+        return [on_result(_) for _ in _apply_adaptive(func, start, end, controller, count)]
+    if min_batch_size is None:
+        min_batch_size = max(max_batch_size // 10, 1) if isinstance(max_batch_size, int) else max_batch_size / 10
+    if on_result is None:
+        on_result = lambda x: x
+    if concurrency <= 1:
+        return [on_result(_) for _ in _apply_sub_range(func, start, end, max_batch_size, min_batch_size)]
+
+    sub_ranges = []
+    batch_start = start
+    while batch_start < end:
+        batch_end = min(batch_start + max_batch_size, end)
+        sub_ranges.append((batch_start, batch_end))
+        batch_start = batch_end
+    log.info(f"applying {func.__name__} to {len(sub_ranges)} sub-ranges of {[start, end]}, concurrency = {concurrency}")
     res = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for s, e in sub_ranges:
+            pending.append(executor.submit(lambda s, e: list(_apply_sub_range(func, s, e, max_batch_size, min_batch_size)), s, e))
+            if len(pending) >= 2 * concurrency: # bound the results held in memory
+                res += [on_result(_) for _ in pending.popleft().result()]
+        while pending:
+            res += [on_result(_) for _ in pending.popleft().result()]
+    return res
+
+
+def _apply_sub_range(func: Callable, start: Any, end: Any, max_batch_size: Any, min_batch_size: Any) -> Iterator[Any]:
+    """ The sequential loop of `apply_range`. A generator, so that results
+    are handed over one by one in the sequential case.
+    """
     batch_start = start
-    if min_batch_size is None:
-        min_batch_size = max_batch_size / 10
     while batch_start < end:
         batch_size = max_batch_size
         while batch_size >= min_batch_size:
             try:
                 batch_end = min(batch_start + batch_size, end)
                 log.info(f"applying {func.__name__} for sub-range {[batch_start, batch_end]}")
-                res.append(func(batch_start, batch_end))
+                res = func(batch_start, batch_end)
                 break
             except Exception as e:
                 log.error(f"failed with error: {e}")
-                batch_size /= 2
+                batch_size = batch_size // 2 if isinstance(batch_size, int) else batch_size / 2
                 if batch_size >= min_batch_size:
                     log.info(f"retrying with smaller batch_size = {batch_size}")
                 else:
                     raise Exception(f"failed with min_batch_size {min_batch_size} at batch_start = {batch_start}")
+        yield res
         batch_start = batch_end
-    return res
+
+
+def _apply_adaptive(func: Callable, start: Any, end: Any, controller: "BatchSizeController", count: Optional[Callable[[Any], int]]) -> Iterator[Any]:
+    batch_start = start
+    while batch_start < end:
+        batch_end = min(batch_start + controller.size, end)
+        log.info(f"applying {func.__name__} for sub-range {[batch_start, batch_end]}")
+        t = time.perf_counter()
+        try:
+            res = func(batch_start, batch_end)
+        except Exception as e:
+            controller.failure(batch_start, batch_end, e) # raises when giving up
+            continue
+        controller.success(batch_start, batch_end,
+                           count=count(res) if count is not None else None,
+                           elapsed=time.perf_counter() - t)
+        yield res
+        batch_start = batch_end
+
+
+class BatchSizeController:
+    """
+    Adaptive batch size for `apply_range`, kept across batches:
+
+    - after `grow_after` consecutive successes the size grows by `grow_factor`;
+    - on an error whose message matches `shrink_errors` (response too large,
+      timeouts) it shrinks by `shrink_factor` and the batch is retried;
+      other errors are retried at the same size up to `max_retries` times;
+    - if `target_count` is given, each success sets the next size to what
+      would have returned `target_count` items at the observed density.
+
+    A size that failed is not grown into again until a few growth steps
+    later. Sizes stay within [`min_size`, `max_size`]; ints stay ints, so
+    block ranges and pd.Timedelta both work. Every batch is recorded in
+    `history`.
+    """
+
+    shrink_errors = (
+        "too large",
+        "too many",
+        "exceed",
+        "more than",
+        "timeout",
+        "timed out",
+    )
+
+    def __init__(self, *,
+                 initial: Any,
+                 min_size: Any=None,
+                 max_size: Any=None,
+                 grow_after: int=3,
+                 grow_factor: float=2.,
+                 shrink_factor: float=.5,
+                 target_count: Optional[int]=None,
+                 max_retries: int=2):
+        self.size = initial
+        self.min_size = min_size if min_size is not None else self._scale(initial, 1 / 64)
+        self.max_size = max_size if max_size is not None else self._scale(initial, 16)
+        self.grow_after = grow_after
+        self.grow_factor = grow_factor
+        self.shrink_factor = shrink_factor
+        self.target_count = target_count
+        self.max_retries = max_retries
+        self.history = []
+        self._successes = 0
+        self._retries = 0
+        self._errors = 0
+        self._ceiling = None # smallest size that failed as too large
+        self._capped = 0
+
+    @staticmethod
+    def _scale(size: Any, factor: float) -> Any:
+        return max(int(size * factor), 1) if isinstance(size, int) else size * factor
+
+    def _clamp(self, size: Any) -> Any:
+        return min(max(size, self.min_size), self.max_size)
+
+    def _resize(self, target: Any):
+        if self._ceiling is not None and target >= self._ceiling:
+            self._capped += 1
+            if self._capped > 4: # probe the failed size again once in a while
+                self._ceiling, self._capped = None, 0
+            else:
+                target = self._scale(self._ceiling, self.shrink_factor)
+        self.size = self._clamp(target)
+
+    def success(self, start: Any, end: Any, *, count: Optional[int]=None, elapsed: Optional[float]=None):
+        size = end - start
+        self.history.append({"start": start, "end": end, "size": size, "retries": self._retries, "count": count, "elapsed": elapsed})
+        log.info(f"batch {[start, end]}: size = {size}, retries = {self._retries}, count = {count}"
+                 + (f", {elapsed:.2f}s" if elapsed is not None else ""))
+        self._retries = 0
+        self._errors = 0
+        self._successes += 1
+        if self.target_count is not None and count is not None:
+            if count == 0:
+                target = self._scale(self.size, self.grow_factor)
+            else:
+                target = self._scale(size, self.target_count / count)
+            self._resize(min(target, self._scale(self.size, self.grow_factor)))
+        elif self._successes >= self.grow_after:
+            self._resize(self._scale(self.size, self.grow_factor))
+            self._successes = 0
+
+    def failure(self, start: Any, end: Any, error: Exception):
+        """ Adjust the size for a retry of the batch at `start`; raise `error`
+        if there's nothing left to try.
+        """
+        self._successes = 0
+        self._retries += 1
+        message = str(error).lower()
+        if any([_ in message for _ in self.shrink_errors]) or "timeout" in type(error).__name__.lower():
+            if self.size <= self.min_size:
+                raise Exception(f"failed with min batch size {self.min_size} at batch_start = {start}") from error
+            size = end - start
+            self._ceiling = size if self._ceiling is None else min(self._ceiling, size)
+            self._capped = 0
+            self.size = self._clamp(self._scale(self.size, self.shrink_factor))
+            log.error(f"batch {[start, end]} failed with error: {error}; retrying with batch size = {self.size}")
+        else:
+            self._errors += 1
+            if self._errors > self.max_retries:
+                raise error
+            log.error(f"batch {[start, end]} failed with error: {error}; retry {self._errors} of {self.max_retries}")
+
+    def summary(self) -> dict:
+        sizes = [_["size"] for _ in self.history]
+        return {
+            "batches": len(self.history),
+            "failed_requests": sum([_["retries"] for _ in self.history]) + self._retries,
+            "min_size": min(sizes) if sizes else None,
+            "max_size": max(sizes) if sizes else None,
+            "last_size": self.size,
+        }
+
+
+class IntervalSet:
+    """
+    A set of integers stored as sorted, disjoint, inclusive intervals [start, end].
+    Adjacent intervals are merged, e.g. [1, 3] + [4, 6] -> [1, 6].
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]]=()):
+        self._intervals = []
+        for start, end in intervals:
+            self.add(start, end)
+
+    def __iter__(self):
+        return iter([tuple(_) for _ in self._intervals])
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def __repr__(self) -> str:
+        return f"IntervalSet({list(self)})"
+
+    @property
+    def max_end(self) -> Optional[int]:
+        return self._intervals[-1][1] if self._intervals else None
+
+    def add(self, start: int, end: int):
+        start, end = int(start), int(end)
+        if start > end:
+            return
+        i = bisect.bisect_left(self._intervals, [start, start])
+        if i > 0 and self._intervals[i - 1][1] >= start - 1:
+            i -= 1
+        j = i
+        while j < len(self._intervals) and self._intervals[j][0] <= end + 1:
+            start = min(start, self._intervals[j][0])
+            end = max(end, self._intervals[j][1])
+            j += 1
+        self._intervals[i:j] = [[start, end]]
+
+    def missing(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """ Sub-intervals of [start, end] not in the set.
+        """
+        res = []
+        cursor = int(start)
+        for s, e in self._intervals:
+            if e < cursor:
+                continue
+            if s > end:
+                break
+            if s > cursor:
+                res.append((cursor, s - 1))
+            cursor = e + 1
+        if cursor <= end:
+            res.append((cursor, int(end)))
+        return res
+
+    def covers(self, start: int, end: int) -> bool:
+        return not self.missing(start, end)
 
 
 class Singleton(type):
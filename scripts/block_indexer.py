@@ -0,0 +1,15 @@
+import sys
+import argparse
+sys.path.insert(0, "../lib")
+from vega.evm.web3 import Web3Portal
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="fill the local block timestamp index")
+    parser.add_argument("--sblock", type=int, required=True)
+    parser.add_argument("--eblock", type=int, default=None, help="inclusive; the latest block if not given")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="blocks saved at a time")
+
+    args = parser.parse_args()
+    p = Web3Portal()
+    p.update_block_index(args.sblock, args.eblock, chunk_size=args.chunk_size)
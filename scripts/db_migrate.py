@@ -0,0 +1,73 @@
+import sys
+import json
+import argparse
+sys.path.insert(0, "../lib")
+from vega import log
+from vega.db import DataBase
+from vega.db.migrate import copy_table, verify_table
+
+
+def open_database(spec: str, workers: int=1) -> DataBase:
+    """ "sqlite:<path>", "mongo:<db_name>" or "parquet:<root_dir>".
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "sqlite":
+        from vega.db.sqlite import SQLiteDB
+        d = SQLiteDB()
+        d.connect(arg, read_pool_size=workers if workers > 1 else 0)
+    elif kind == "mongo":
+        from vega.db.mongo import MongoDB
+        d = MongoDB()
+        d.init(arg or "dex")
+    elif kind == "parquet":
+        from vega.db.parquet import ParquetDB
+        d = ParquetDB()
+        d.init(arg)
+    else:
+        raise ValueError(f"unsupported database {spec}")
+    return d
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="stream a table from one database to another, or convert legacy fields in place")
+    parser.add_argument("--src", type=str, required=True, help="sqlite:<path>, mongo:<db_name> or parquet:<root_dir>")
+    parser.add_argument("--dst", type=str, help="same format as --src")
+    parser.add_argument("--table", type=str, required=True)
+    parser.add_argument("--dst-table", type=str, default=None)
+    parser.add_argument("--index", type=str, help="comma separated index columns")
+    parser.add_argument("--sblock", type=int, default=None)
+    parser.add_argument("--eblock", type=int, default=None, help="exclusive")
+    parser.add_argument("--window-blocks", type=int, default=100_000)
+    parser.add_argument("--max-rows", type=int, default=200_000, help="rows per read, bounds the memory used")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--checkpoint", type=str, default=None, help="json file to resume from")
+    parser.add_argument("--no-verify", action="store_true")
+    parser.add_argument("--verify-only", action="store_true")
+    parser.add_argument("--convert-legacy", type=str, default=None,
+                        help="with a mongo --src, re-encode legacy fields of --table in place, e.g. blockNumber:int,logIndex:int,amount:int256")
+
+    args = parser.parse_args()
+    src = open_database(args.src, workers=args.workers)
+    if args.convert_legacy is not None:
+        types = dict([_.split(":") for _ in args.convert_legacy.split(",")])
+        log.info(json.dumps(src.convert_legacy_columns(args.table, types=types), indent=4))
+        sys.exit(0)
+    if args.dst is None or args.index is None:
+        parser.error("--dst and --index are required to copy")
+    dst = open_database(args.dst, workers=args.workers)
+    kw = dict(
+        index=args.index.split(","),
+        dst_table_name=args.dst_table,
+        block_range=(args.sblock, args.eblock),
+        window_blocks=args.window_blocks,
+        max_rows=args.max_rows,
+        workers=args.workers,
+    )
+    if args.verify_only:
+        report = verify_table(src, dst, args.table, **kw)
+    else:
+        report = copy_table(src, dst, args.table, checkpoint=args.checkpoint, verify=not args.no_verify, **kw)
+    log.info(json.dumps(report, indent=4, default=str))
+    if not report.get("verify", report).get("ok", True):
+        sys.exit(1)
@@ -3,6 +3,7 @@ import sys
 import pandas as pd
 sys.path.insert(0, "../lib")
 from vega.apps.tables import TokenInfo, event_archive_factory, event_archive_parser
+from vega.utils import BatchSizeController
 
 if __name__ == "__main__":
 
@@ -29,15 +30,31 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
-    ea = event_archive_factory(args.name)
-    batch_freq = args.batch_freq
+    ea = event_archive_factory(
+        args.name,
+        binary_hex=args.binary_hex,
+        cold_dir=args.cold_dir,
+        hot_blocks=args.hot_blocks)
+    if args.batch_blocks is not None:
+        batch = dict(batch_blocks=args.batch_blocks)
+    else:
+        batch = dict(batch_freq=args.batch_freq)
+    if args.adaptive:
+        batch["batch_controller"] = BatchSizeController(
+            initial=args.batch_blocks or pd.Timedelta(args.batch_freq),
+            target_count=args.target_logs)
 
     if args.fetch_new:
-        ea.fetch_new(batch_freq=batch_freq)
+        ea.fetch_new(**batch, pipeline=args.pipeline, concurrency=args.concurrency)
     else:
         stime = pd.to_datetime(args.stime, utc=True)
         etime = pd.to_datetime(args.etime, utc=True)
         ea.fetch_range(
             stime=stime,
             etime=etime,
-            batch_freq=batch_freq)
+            **batch,
+            pipeline=args.pipeline,
+            concurrency=args.concurrency)
+
+    if args.cold_dir is not None:
+        ea.d.migrate(ea.table_name, index=ea.index)
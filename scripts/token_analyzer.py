@@ -10,6 +10,7 @@ from pathlib import Path
 from vega import log
 from vega.evm.web3 import Web3Portal
 from vega.evm.web3 import ContractEvent
+from vega.segments import SegmentStore
 
 
 class ERC20TokenTracker(Web3Portal):
@@ -52,7 +53,8 @@ if __name__ == "__main__":
 
     #token_addr = "0x1e8ee2fa31bfe35451c1310130029dd37695c23b"
     token_addr = args.addr
-    file_path = os.path.expandvars(f"$HOME/vega/data/wallet/{token_addr}.csv")
+    legacy_file_path = os.path.expandvars(f"$HOME/vega/data/wallet/{token_addr}.csv")
+    store = SegmentStore(os.path.expandvars(f"$HOME/vega/data/wallet/{token_addr}"))
     p = ERC20TokenTracker()
     p.init()
     token_addr = p.web3.to_checksum_address(token_addr)
@@ -62,14 +64,15 @@ if __name__ == "__main__":
     c = p.web3.eth.contract(address=pool, abi=abi)
     e = c.events["Swap"]()
 
-    if args.restart or not os.path.exists(file_path):
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    if args.restart or not (store.exists() or os.path.exists(legacy_file_path)):
+        if os.path.exists(legacy_file_path):
+            os.remove(legacy_file_path)
+        store.clear()
         stime = p.get_token_creation_time(addr=token_addr)
-        df0 = pd.DataFrame()
     else:
-        df0 = pd.read_csv(file_path)
-        stime = pd.to_datetime(df0["timestamp"].max())
+        if not store.exists(): # one-off import of the single-file output
+            store.append(pd.read_csv(legacy_file_path))
+        stime = store.max_timestamp
         log.info(f"warm start at {stime}")
 
     etime = pd.Timestamp.utcnow()
@@ -104,11 +107,7 @@ if __name__ == "__main__":
         output_vars = ["trader", "token_amount", "weth_amount", "side", "price_weth", "timestamp", "timestamp_est", "transactionHash"]
 
     df_summary = df[output_vars].copy()
-    df_total = pd.concat([
-        df0,
-        df_summary,
-    ])
-    
-    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-    log.info(f"{file_path}")
-    df_total.to_csv(file_path, index=False)
\ No newline at end of file
+    store.append(df_summary)
+    compaction = store.maybe_compact()
+    if compaction is not None:
+        compaction.join()
\ No newline at end of file
@@ -12,17 +12,24 @@ from dash_bootstrap_templates import load_figure_template
 import pandas as pd
 import numpy as np
 from typing import Tuple
+from collections import OrderedDict
 from pprint import pprint
-import cachetools.func
 
 sys.path.insert(0, "../lib/")
 from vega.apps.tables import event_archive_factory, TokenInfo
 from vega.evm.web3 import ERC20TokenTracker
+from vega.db.cache import CachedDataBase
 
 p = ERC20TokenTracker()
 p.init()
 ti = TokenInfo()
 swaps = event_archive_factory("uniswap_v2_swap")
+swaps_db = CachedDataBase(
+    swaps.d,
+    # the archive is written by event_writer.py, which changes its version on every write, backfills included
+    probe=lambda table_name: swaps.version(),
+)
+token_data = OrderedDict() # token_addr -> (swaps version, df, info), the last 32 tokens
 place_holder = "0xE0f63A424a4439cBE457D80E4f4b51aD25b2c56C"
 
 
@@ -202,12 +209,26 @@ def update_info_table(token_addr: str):
     return [df.to_dict("records"), columns]
 
 
-@cachetools.func.ttl_cache(maxsize=128, ttl= 60)
 def load_token_data(token_addr: str) -> Tuple[pd.DataFrame, dict]:
+    """ Swaps and info of a token, recomputed only when the swaps archive changed.
+    """
+    version = swaps_db.refresh(swaps.table_name)
+    cached = token_data.get(token_addr)
+    if cached is not None and cached[0] == version:
+        token_data.move_to_end(token_addr)
+        return cached[1].copy(), cached[2]
+    df, info = _load_token_data(token_addr)
+    token_data[token_addr] = (version, df, info)
+    while len(token_data) > 32:
+        token_data.popitem(last=False)
+    return df.copy(), info
+
+
+def _load_token_data(token_addr: str) -> Tuple[pd.DataFrame, dict]:
     ti.touch(token_addr)
     info = ti.get_token_info(token_addr)
     pool = p.get_univswap_v2_pair(token_addr)
-    df = swaps.db.read_sql(f"SELECT * from {swaps.table_name} where address = '{pool}'")
+    df = swaps_db.query(swaps.table_name, where={"address": pool})
     df["timestamp_"] = p.get_timestamp_from_block_number(df["blockNumber"])
     df["timestamp"] = df["timestamp_"].dt.tz_convert(tz.tzlocal()).dt.strftime("%Y%m%d-%H:%M:%S")
     df["tx"] = df["transactionHash"].apply(lambda tx_hash: f"""[tx](https://etherscan.io/tx/{tx_hash})""")
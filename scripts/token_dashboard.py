@@ -13,10 +13,23 @@ import pandas as pd
 import numpy as np
 from pprint import pprint
 from vega.apps.tables import TokenInfo, event_archive_factory
+from vega.segments import SegmentStore
 
 ti = TokenInfo()
 swaps = event_archive_factory("uniswap_v2_swap")
 
+
+def load_wallet(addr: str) -> pd.DataFrame:
+    """ Read the segments written by wallet_analyzer.py, or the single-file
+    output of older runs if it hasn't been imported into segments yet.
+    """
+    store = SegmentStore(os.path.expandvars(f"$HOME/vega/data/wallet/{addr}"))
+    legacy_file_path = os.path.expandvars(f"$HOME/vega/data/wallet/{addr}.csv")
+    if not store.exists() and os.path.exists(legacy_file_path):
+        return pd.read_csv(legacy_file_path)
+    return store.read()
+
+
 app = Dash(
     __name__,
     external_stylesheets=[dbc.themes.SLATE],# of course i need a dark mode
@@ -68,7 +81,7 @@ def update_graph(addr: str) -> go.Figure:
     """
     Plot price chart for `addr`.
     """
-    df = db.read_table(f"wallet/{addr}.csv")
+    df = load_wallet(addr)
     fig = px.line(
         df,
         x="timestamp",
@@ -94,7 +107,7 @@ def update_graph(addr: str) -> go.Figure:
 )
 def update_table(token_addr: str):
     # load
-    df = db.read_table(f"wallet/{token_addr}.csv").sort_values("timestamp", ascending=False)
+    df = load_wallet(token_addr).sort_values("timestamp", ascending=False)
     df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601").dt.tz_convert(tz.tzlocal()).dt.strftime("%Y%m%d-%H:%M:%S")
     df["tx"] = df["transactionHash"].apply(lambda tx_hash: f"""[tx](https://etherscan.io/tx/{tx_hash})""")
     df["token"] = df["address"].apply(lambda addr: f"[{addr[:6]}...{addr[-4:]}](https://etherscan.io/address/{addr})")
@@ -2,7 +2,6 @@ import os
 import sys
 sys.path.insert(0, "../lib")
 import web3
-from tqdm import tqdm
 import vega
 import pandas as pd
 import numpy as np
@@ -11,6 +10,7 @@ from pathlib import Path
 from vega import log
 from vega.evm.web3 import Web3Portal
 from vega.evm.web3 import ContractEvent
+from vega.segments import SegmentStore
 
 
 def parse_trade(df):
@@ -52,7 +52,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     addr = args.addr
-    file_path = os.path.expandvars(f"$HOME/vega/data/wallet/{addr}.csv")
+    legacy_file_path = os.path.expandvars(f"$HOME/vega/data/wallet/{addr}.csv")
+    store = SegmentStore(os.path.expandvars(f"$HOME/vega/data/wallet/{addr}"))
     p = Web3Portal()
     p.init()
     addr = p.web3.to_checksum_address(addr)
@@ -62,14 +63,15 @@ if __name__ == "__main__":
     c = p.web3.eth.contract(address=dummy_erc20_addr, abi=abi)
     e = c.events["Transfer"]()
 
-    if args.restart or not os.path.exists(file_path):
-        if os.path.exists(file_path):
-            os.remove(file_path)
+    if args.restart or not (store.exists() or os.path.exists(legacy_file_path)):
+        if os.path.exists(legacy_file_path):
+            os.remove(legacy_file_path)
+        store.clear()
         stime = pd.to_datetime(str(args.sdate), utc=True)
-        df0 = pd.DataFrame()
     else:
-        df0 = pd.read_csv(file_path)
-        stime = pd.to_datetime(df0["timestamp"].max())
+        if not store.exists(): # one-off import of the single-file output
+            store.append(pd.read_csv(legacy_file_path))
+        stime = store.max_timestamp
         log.info(f"warm start at {stime}")
 
     etime = pd.Timestamp.utcnow()
@@ -85,11 +87,10 @@ if __name__ == "__main__":
             [addr_to_topic(addr), None],
         ]])
     print(df.describe())
-    for i, row in tqdm(df.iterrows()):
-        block_number = row["blockNumber"]
-        balance = p.web3.eth.get_balance(addr, block_number)
-        df.loc[i, "balance"] = balance
-        df.loc[i, "balance_eth"] = balance / 1e18
+    if len(df) > 0:
+        balances = p.get_balances([addr] * len(df), df["blockNumber"].astype(int).tolist())
+        df["balance"] = balances
+        df["balance_eth"] = [_ / 1e18 for _ in balances]
     """
     all_txs = pd.DataFrame(
         p.scan.get(
@@ -110,11 +111,7 @@ if __name__ == "__main__":
         df = df.sort_values(["blockNumber", "transactionIndex"])
     output_vars = df.columns
     df_summary = df[output_vars].copy()
-    df_total = pd.concat([
-        df0,
-        df_summary,
-    ])
-    
-    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-    log.info(f"{file_path}")
-    df_total.to_csv(file_path, index=False)
\ No newline at end of file
+    store.append(df_summary)
+    compaction = store.maybe_compact()
+    if compaction is not None:
+        compaction.join()
\ No newline at end of file